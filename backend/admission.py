@@ -0,0 +1,265 @@
+"""Admission control for expensive endpoints.
+
+Each endpoint class has a policy with a per-caller token bucket, a global
+token bucket and a concurrency limit with a bounded wait queue. Rate limit
+rejections are 429 and overload rejections 503, both with ``Retry-After``.
+
+Bucket state lives in-process by default. With the ``mongo`` store the
+buckets are shared by all workers through atomic pipeline updates on the
+``rate_limits`` collection; the concurrency limit always applies per worker.
+
+Anonymous callers are keyed by client address. Behind a reverse proxy every
+request arrives from the proxy, so ``client_address`` honours
+``X-Forwarded-For`` when the peer is one of the configured trusted proxies.
+Until the deployment says which proxies it trusts (or that it has none), the
+peer address may be the proxy's, so anonymous callers get no per-caller
+bucket and are limited by the global bucket alone.
+
+Tokens are only spent on admitted requests: a request rejected by a later
+check gets back the tokens the earlier checks took.
+"""
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import ipaddress
+import logging
+import math
+import time
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointPolicy(BaseModel):
+    user_rate: float
+    user_burst: float
+    global_rate: float
+    global_burst: float
+    max_concurrency: int
+    max_queue: int
+    queue_timeout: float = 5.0
+
+
+DEFAULT_POLICIES = {
+    "login": EndpointPolicy(user_rate=5 / 60, user_burst=10, global_rate=50, global_burst=100,
+                            max_concurrency=8, max_queue=32),
+    "create": EndpointPolicy(user_rate=1, user_burst=20, global_rate=100, global_burst=200,
+                             max_concurrency=32, max_queue=64),
+    "bulk": EndpointPolicy(user_rate=2 / 60, user_burst=3, global_rate=5, global_burst=10,
+                           max_concurrency=4, max_queue=8, queue_timeout=10.0),
+    "refresh": EndpointPolicy(user_rate=0.5, user_burst=10, global_rate=50, global_burst=100,
+                              max_concurrency=16, max_queue=64),
+}
+
+
+def parse_networks(values: Iterable[str]) -> List:
+    return [ipaddress.ip_network(v.strip(), strict=False) for v in values if v.strip()]
+
+
+def parse_trusted_proxies(value: Optional[str]) -> Optional[List[str]]:
+    """``TRUSTED_PROXIES``: comma-separated networks, ``none`` when clients
+    connect directly, or unset (None)."""
+    if value is None or not value.strip():
+        return None
+    if value.strip().lower() == "none":
+        return []
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _trusted(address: str, networks: List) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str], trusted_proxies: List) -> str:
+    """The caller's address: the peer, or, when the peer is a trusted proxy,
+    the right-most ``X-Forwarded-For`` entry that is not itself trusted."""
+    address = peer or "unknown"
+    if not forwarded_for or not _trusted(address, trusted_proxies):
+        return address
+    for hop in reversed([h.strip() for h in forwarded_for.split(",") if h.strip()]):
+        address = hop
+        if not _trusted(hop, trusted_proxies):
+            break
+    return address
+
+
+class MemoryBucketStore:
+    """In-process token buckets. A bucket that has refilled completely is
+    the same as no bucket, so those are pruned every ``prune_interval``
+    seconds to keep one-off callers from accumulating."""
+
+    def __init__(self, prune_interval: float = 60.0):
+        self.buckets: Dict[str, Tuple[float, float, float]] = {}
+        self.prune_interval = prune_interval
+        self._pruned_at = time.monotonic()
+
+    def prune(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        full = [key for key, (_, _, full_at) in self.buckets.items() if full_at <= now]
+        for key in full:
+            del self.buckets[key]
+        self._pruned_at = now
+        return len(full)
+
+    async def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        if now - self._pruned_at >= self.prune_interval:
+            self.prune(now)
+        tokens, updated, _ = self.buckets.get(key, (burst, now, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    async def give_back(self, key: str, rate: float, burst: float):
+        if key in self.buckets:
+            tokens, updated, _ = self.buckets[key]
+            tokens = min(burst, tokens + 1)
+            self.buckets[key] = (tokens, updated, updated + (burst - tokens) / rate)
+
+
+class MongoBucketStore:
+    def __init__(self, get_collection: Callable):
+        self.get_collection = get_collection
+        self._indexed = False
+
+    async def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        collection = self.get_collection()
+        if not self._indexed:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+
+        now = time.time()
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=burst / rate + 60)
+        bucket = await collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [burst, {"$add": [
+                        {"$ifNull": ["$tokens", burst]},
+                        {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, rate]},
+                    ]}]},
+                    "ts": now,
+                    "expires_at": expires_at,
+                }},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket['allowed']:
+            return True, 0.0
+        return False, (1 - bucket['tokens']) / rate
+
+    async def give_back(self, key: str, rate: float, burst: float):
+        await self.get_collection().update_one(
+            {"_id": key},
+            [{"$set": {"tokens": {"$min": [burst, {"$add": ["$tokens", 1]}]}}}]
+        )
+
+
+class _ConcurrencyLimiter:
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.max_queue = max_queue
+        self.waiting = 0
+
+    async def acquire(self, timeout: float) -> bool:
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+            return True
+        if self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+
+class AdmissionController:
+    def __init__(self, policies: Dict[str, EndpointPolicy], store=None):
+        self.policies = policies
+        self.store = store or MemoryBucketStore()
+        self.limiters = {name: _ConcurrencyLimiter(p.max_concurrency, p.max_queue) for name, p in policies.items()}
+        self.admitted = Counter()
+        self.shed = Counter()
+
+    def _reject(self, endpoint_class: str, reason: str, status_code: int, retry_after: float):
+        self.shed[f"{endpoint_class}:{reason}"] += 1
+        logger.warning(f"Shed {endpoint_class} request: {reason}")
+        raise HTTPException(
+            status_code=status_code,
+            detail="Too many requests, try again later" if status_code == 429 else "Server busy, try again later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    @asynccontextmanager
+    async def admit(self, endpoint_class: str, caller: Optional[str]):
+        """Admit a request from ``caller``; None skips the per-caller bucket."""
+        policy = self.policies.get(endpoint_class)
+        if policy is None:
+            yield
+            return
+
+        taken = []
+        try:
+            if caller is not None:
+                user_bucket = (f"{endpoint_class}:{caller}", policy.user_rate, policy.user_burst)
+                allowed, retry_after = await self.store.take(*user_bucket)
+                if not allowed:
+                    self._reject(endpoint_class, "user_rate", status.HTTP_429_TOO_MANY_REQUESTS, retry_after)
+                taken.append(user_bucket)
+            global_bucket = (f"{endpoint_class}:*", policy.global_rate, policy.global_burst)
+            allowed, retry_after = await self.store.take(*global_bucket)
+            if not allowed:
+                self._reject(endpoint_class, "global_rate", status.HTTP_503_SERVICE_UNAVAILABLE, retry_after)
+            taken.append(global_bucket)
+
+            limiter = self.limiters[endpoint_class]
+            if not await limiter.acquire(policy.queue_timeout):
+                self._reject(endpoint_class, "concurrency", status.HTTP_503_SERVICE_UNAVAILABLE, policy.queue_timeout)
+        except HTTPException:
+            for bucket in taken:
+                await self.store.give_back(*bucket)
+            raise
+        self.admitted[endpoint_class] += 1
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def stats(self) -> dict:
+        return {
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+            "in_flight": {name: l.limit - l.semaphore._value for name, l in self.limiters.items()},
+            "queued": {name: l.waiting for name, l in self.limiters.items()},
+        }
+
+
+def build_policies(overrides: Optional[dict] = None) -> Dict[str, EndpointPolicy]:
+    policies = dict(DEFAULT_POLICIES)
+    for name, values in (overrides or {}).items():
+        base = policies.get(name)
+        policies[name] = base.model_copy(update=values) if base else EndpointPolicy(**values)
+    return policies
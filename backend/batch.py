@@ -0,0 +1,143 @@
+"""In-process execution of batched GET sub-requests.
+
+``POST /api/batch`` authenticates once and then runs each sub-request through
+the application as its own ASGI request, concurrently on the event loop. What
+the sub-requests have in common lives in a ``BatchContext`` (copied into every
+sub-request task through ``batch_context``): the authenticated user, so
+``get_current_user`` skips the JWT decode and user lookup, and the user's data
+version, read once from the primary so conditional GETs skip their own version
+read. Its causal session times are handed on to each sub-request's session, so
+routed reads still see the user's own writes. Anything else loaded per user,
+such as settings, is shared through ``BatchContext.shared``. Nothing outside a
+batch sets the context, so it cannot be supplied by a client.
+
+Sub-requests go through the full app, so routing, validation, conditional
+GETs and exception handlers behave exactly as for direct calls. Paths may be
+given with or without the ``/api`` prefix. Only the ``Authorization`` header
+and an optional ``If-None-Match`` are forwarded, so sub-responses are never
+compressed and admin routes stay unreachable.
+"""
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BatchContext:
+    def __init__(self, user, data_version: int, session=None):
+        self.user = user
+        self.data_version = data_version
+        self.cluster_time = getattr(session, "cluster_time", None)
+        self.operation_time = getattr(session, "operation_time", None)
+        self._shared: Dict[str, asyncio.Future] = {}
+
+    def advance(self, session):
+        """Make ``session`` causally follow the batch's version read."""
+        if self.cluster_time is not None:
+            session.advance_cluster_time(self.cluster_time)
+        if self.operation_time is not None:
+            session.advance_operation_time(self.operation_time)
+
+    async def shared(self, key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of ``load()``, run once per batch; concurrent sub-requests
+        asking for the same ``key`` wait for the same load."""
+        task = self._shared.get(key)
+        if task is None:
+            task = self._shared[key] = asyncio.ensure_future(load())
+        return await asyncio.shield(task)
+
+
+batch_context: ContextVar[Optional[BatchContext]] = ContextVar("batch_context", default=None)
+
+
+class SubRequestError(ValueError):
+    pass
+
+
+def validate_path(path: str, prefix: str = "/api") -> str:
+    """Return the sub-request path under ``prefix``, which the client may
+    include or leave out, rejecting anything that is not a plain API path or
+    that would recurse into the batch endpoint."""
+    if not path.startswith("/") or path.startswith("//") or "#" in path:
+        raise SubRequestError(f"Invalid path: {path}")
+    if path.partition("?")[0] == prefix or path.startswith((prefix + "/", prefix + "?")):
+        path = path[len(prefix):] or "/"
+    route = path.partition("?")[0]
+    if route.rstrip("/") == "/batch":
+        raise SubRequestError("Batch requests cannot be nested")
+    return prefix + path
+
+
+async def dispatch(app, request, path: str, if_none_match: Optional[str] = None) -> dict:
+    route, _, query = path.partition("?")
+    headers = [(b"authorization", request.headers.get("authorization", "").encode())]
+    if if_none_match:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": request.scope.get("scheme", "http"),
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        "path": route,
+        "raw_path": route.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "state": dict(request.scope.get("state") or {}),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    start = {}
+    chunks = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    except Exception as e:
+        logger.error(f"Batch sub-request {route} failed: {str(e)}")
+        if not start:
+            return {"status": 500, "body": {"detail": "Internal Server Error"}}
+
+    response_headers = {k.decode().lower(): v.decode() for k, v in start.get("headers", [])}
+    body = b"".join(chunks)
+    result = {"status": start.get("status", 500)}
+    if "etag" in response_headers:
+        result["etag"] = response_headers["etag"]
+    if body:
+        try:
+            result["body"] = json.loads(body)
+        except ValueError:
+            result["body"] = body.decode(errors="replace")
+    return result
+
+
+async def run_batch(app, request, context: BatchContext, items: List[dict], prefix: str = "/api") -> List[dict]:
+    """Run ``items`` (``{"id", "path", "if_none_match"}``) concurrently in
+    ``context``. Results keep the order of ``items``; a failing item only
+    affects its own entry."""
+    async def run(item):
+        try:
+            path = validate_path(item["path"], prefix)
+        except SubRequestError as e:
+            return {"status": 400, "body": {"detail": str(e)}}
+        return await dispatch(app, request, path, item.get("if_none_match"))
+
+    token = batch_context.set(context)
+    try:
+        results = await asyncio.gather(*(run(item) for item in items))
+    finally:
+        batch_context.reset(token)
+    return [{"id": item.get("id") or str(index), **result} for index, (item, result) in enumerate(zip(items, results))]
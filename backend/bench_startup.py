@@ -0,0 +1,73 @@
+"""Cold-start benchmark: time from spawning a worker process to its first
+successful response on ``/api/health``.
+
+    python bench_startup.py [--runs 5] [--no-scheduler]
+"""
+from pathlib import Path
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT_DIR = Path(__file__).parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_import(env: dict) -> float:
+    code = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def time_first_request(env: dict, timeout: float = 30.0) -> float:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/api/health"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"worker did not answer {url} within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-scheduler", action="store_true", help="start workers with ENABLE_SCHEDULER=false")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    if args.no_scheduler:
+        env['ENABLE_SCHEDULER'] = 'false'
+
+    imports = [time_import(env) for _ in range(args.runs)]
+    first_requests = [time_first_request(env) for _ in range(args.runs)]
+    for name, samples in (("import server", imports), ("time to first request", first_requests)):
+        print(f"{name:>22}: median {statistics.median(samples) * 1000:7.1f} ms  "
+              f"min {min(samples) * 1000:7.1f} ms  max {max(samples) * 1000:7.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,105 @@
+"""Negotiated response compression.
+
+Compresses text and JSON responses of at least ``minimum_size`` bytes with
+brotli when the client accepts ``br``, else gzip. Whenever an encoding is
+negotiated, the response's ETag gets its suffix (``"abc-3-gzip"``), whether
+or not this particular body was big enough to compress and including 304s,
+so each representation keeps one distinct strong validator;
+``strip_encoding_suffix`` maps it back for ``If-None-Match``.
+"""
+from typing import Optional
+import gzip
+
+import brotli
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+ENCODING_SUFFIXES = ("-br", "-gzip")
+
+
+def strip_encoding_suffix(etag: str) -> str:
+    for suffix in ENCODING_SUFFIXES:
+        if etag.endswith(f'{suffix}"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    if accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode())
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                return await send(message)
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            response_headers = [(k, v) for k, v in start.get("headers", [])]
+            names = {k.lower() for k, _ in response_headers}
+            if b"content-encoding" in names:
+                await send(start)
+                return await send({"type": "http.response.body", "body": body})
+
+            content_type = next((v for k, v in response_headers if k.lower() == b"content-type"), b"")
+            compressed = len(body) >= self.minimum_size and content_type.startswith(COMPRESSIBLE_TYPES)
+            if compressed:
+                body = compress(body, encoding)
+            rewritten = []
+            for key, value in response_headers:
+                lowered = key.lower()
+                if compressed and lowered == b"content-length":
+                    continue
+                if lowered == b"etag" and value.endswith(b'"'):
+                    value = value[:-1] + f"-{encoding}".encode() + b'"'
+                rewritten.append((key, value))
+            if compressed:
+                rewritten += [
+                    (b"content-encoding", encoding.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                ]
+            rewritten.append((b"vary", b"Accept-Encoding"))
+            await send({**start, "headers": rewritten})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
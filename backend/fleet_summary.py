@@ -0,0 +1,320 @@
+"""Materialized per-user fleet summaries.
+
+One document per user in ``fleet_summaries`` keyed by ``_id = user_id``. It holds
+the vehicle count and, for every document type, how many expiries fall in each
+bucket relative to the summary clock (``as_of``, midnight UTC of the day the
+counts are valid for). Vehicle writes keep it current with ``$inc``; the daily
+roll-forward moves ``as_of`` to today and shifts only the vehicles whose expiry
+crossed a bucket boundary in between.
+
+Every change to a summary increments its ``revision``. A vehicle write reads
+the revision before it touches the vehicle and applies its delta only if the
+revision is unchanged; a rebuild reads it before taking its snapshot and
+replaces the summary only if it is unchanged. Whichever side misses rebuilds
+again, so a write is neither lost from nor counted twice in a summary.
+
+Usage::
+
+    python fleet_summary.py rebuild [--user USER_ID]
+    python fleet_summary.py verify [--user USER_ID] [--fix]
+    python fleet_summary.py roll
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import vehicle_documents
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TYPES = vehicle_documents.DOCUMENT_TYPES
+DASHBOARD_DOCUMENT_TYPES = vehicle_documents.REMINDER_TYPES
+BUCKETS = ['overdue', 'expiring', 'valid', 'missing']
+EXPIRING_WINDOW = timedelta(days=30)
+REBUILD_ATTEMPTS = 3
+
+
+def summary_clock(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now(timezone.utc)
+    return now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _parse_expiry(value):
+    if not value:
+        return None
+    expiry = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry
+
+
+def classify_expiry(value, clock: datetime) -> str:
+    expiry = _parse_expiry(value)
+    if expiry is None:
+        return 'missing'
+    if expiry < clock:
+        return 'overdue'
+    if expiry <= clock + EXPIRING_WINDOW:
+        return 'expiring'
+    return 'valid'
+
+
+def vehicle_delta(vehicle: dict, clock: datetime, sign: int = 1) -> Dict[str, int]:
+    delta = {'total_vehicles': sign}
+    for doc_type, expiry in vehicle_documents.expiries(vehicle).items():
+        bucket = classify_expiry(expiry, clock)
+        delta[f"buckets.{doc_type}.{bucket}"] = sign
+    return delta
+
+
+def merge_deltas(*deltas: Dict[str, int]) -> Dict[str, int]:
+    merged: Dict[str, int] = defaultdict(int)
+    for delta in deltas:
+        for key, value in delta.items():
+            merged[key] += value
+    return {key: value for key, value in merged.items() if value}
+
+
+def empty_summary(user_id: str, clock: datetime) -> dict:
+    return {
+        '_id': user_id,
+        'user_id': user_id,
+        'as_of': clock.isoformat(),
+        'total_vehicles': 0,
+        'buckets': {doc_type: {bucket: 0 for bucket in BUCKETS} for doc_type in DOCUMENT_TYPES},
+    }
+
+
+def summarize_vehicles(user_id: str, vehicles: Iterable[dict], clock: datetime) -> dict:
+    summary = empty_summary(user_id, clock)
+    for vehicle in vehicles:
+        summary['total_vehicles'] += 1
+        for doc_type, expiry in vehicle_documents.expiries(vehicle).items():
+            bucket = classify_expiry(expiry, clock)
+            summary['buckets'][doc_type][bucket] += 1
+    return summary
+
+
+def dashboard_view(summary: dict) -> dict:
+    buckets = summary['buckets']
+    return {
+        "total_vehicles": summary['total_vehicles'],
+        "expiring_this_month": sum(buckets[t]['expiring'] for t in DASHBOARD_DOCUMENT_TYPES),
+        "overdue": {t: buckets[t]['overdue'] for t in DASHBOARD_DOCUMENT_TYPES},
+    }
+
+
+_EXPIRY_PROJECTION = {"_id": 0, "user_id": 1, **vehicle_documents.projection(vehicle_documents.EXPIRY_FIELDS)}
+
+
+async def summary_revision(db, user_id: str) -> Optional[int]:
+    """The user's summary revision. Read it before a vehicle write and pass
+    it to ``apply_delta`` afterwards."""
+    summary = await db.fleet_summaries.find_one({"_id": user_id}, {"revision": 1})
+    return summary.get('revision') if summary else None
+
+
+async def _store_summary(db, summary: dict, current: Optional[dict]) -> bool:
+    """Store a recomputed ``summary`` unless the one it replaces (``current``,
+    read before the snapshot, or None) has changed since."""
+    revision = current.get('revision') if current else None
+    summary['revision'] = (revision or 0) + 1
+    if current is None:
+        try:
+            await db.fleet_summaries.insert_one(summary)
+            return True
+        except DuplicateKeyError:
+            return False
+    result = await db.fleet_summaries.replace_one({"_id": summary['_id'], "revision": revision}, summary)
+    return bool(result.matched_count)
+
+
+async def rebuild_user_summary(db, user_id: str, now: Optional[datetime] = None) -> dict:
+    """Recompute the user's summary from their vehicles, retrying while
+    concurrent writes change it. After ``REBUILD_ATTEMPTS`` misses the
+    concurrently written summary is kept."""
+    clock = summary_clock(now)
+    for _ in range(REBUILD_ATTEMPTS):
+        current = await db.fleet_summaries.find_one({"_id": user_id}, {"revision": 1})
+        vehicles = await db.vehicles.find({"user_id": user_id}, _EXPIRY_PROJECTION).to_list(None)
+        summary = summarize_vehicles(user_id, vehicles, clock)
+        summary['updated_at'] = datetime.now(timezone.utc).isoformat()
+        if await _store_summary(db, summary, current):
+            return summary
+    logger.warning(f"Fleet summary for {user_id} kept changing, keeping the stored one")
+    return await db.fleet_summaries.find_one({"_id": user_id}) or summary
+
+
+async def apply_delta(db, user_id: str, delta: Dict[str, int], revision: Optional[int],
+                      now: Optional[datetime] = None):
+    """Apply ``delta`` to the user's summary if it is still at ``revision``
+    (from ``summary_revision`` before the vehicle write) and today's clock,
+    otherwise rebuild it. Call after the vehicle write."""
+    if not delta:
+        return
+    clock = summary_clock(now)
+    result = await db.fleet_summaries.update_one(
+        {"_id": user_id, "as_of": clock.isoformat(), "revision": revision},
+        {"$inc": {**delta, "revision": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    if not result.matched_count:
+        await rebuild_user_summary(db, user_id, now)
+
+
+async def get_user_summary(db, user_id: str, now: Optional[datetime] = None, read_db=None, session=None) -> dict:
+    """Read the user's summary, from ``read_db`` if given (e.g. a secondary
+    handle), rebuilding it on the primary ``db`` when missing or stale."""
+    clock = summary_clock(now)
+    summary = await (read_db or db).fleet_summaries.find_one({"_id": user_id}, session=session)
+    if summary is None or summary.get('as_of') != clock.isoformat():
+        summary = await rebuild_user_summary(db, user_id, now)
+    return summary
+
+
+async def _compute_all(db, clock: datetime, user_id: Optional[str] = None) -> Dict[str, dict]:
+    pipeline = vehicle_documents.expiring_pipeline(
+        match={"user_id": user_id} if user_id else None,
+        group_by=('user_id', 'type', 'bucket'),
+        buckets=[('overdue', '$lt', clock), ('expiring', '$lte', clock + EXPIRING_WINDOW)],
+        otherwise='valid',
+    )
+    summaries: Dict[str, dict] = {}
+    async for row in db.vehicles.aggregate(pipeline):
+        key = row['_id']
+        summary = summaries.setdefault(key['user_id'], empty_summary(key['user_id'], clock))
+        summary['buckets'][key['type']][key['bucket']] += row['count']
+    for summary in summaries.values():
+        # Every vehicle lands in exactly one bucket per document type.
+        summary['total_vehicles'] = sum(summary['buckets'][DOCUMENT_TYPES[0]].values())
+    return summaries
+
+
+async def rebuild_all(db, user_id: Optional[str] = None, now: Optional[datetime] = None) -> int:
+    clock = summary_clock(now)
+    stored_query = {"_id": user_id} if user_id else {}
+    current = {s['_id']: s async for s in db.fleet_summaries.find(stored_query, {"revision": 1})}
+    computed = await _compute_all(db, clock, user_id)
+    for uid in current:
+        computed.setdefault(uid, empty_summary(uid, clock))
+
+    updated_at = datetime.now(timezone.utc).isoformat()
+    for uid, summary in computed.items():
+        summary['updated_at'] = updated_at
+        if not await _store_summary(db, summary, current.get(uid)):
+            await rebuild_user_summary(db, uid, now)
+    return len(computed)
+
+
+async def verify_all(db, user_id: Optional[str] = None, fix: bool = False,
+                     now: Optional[datetime] = None) -> Dict[str, dict]:
+    """Compare stored summaries against a fresh computation. Returns the
+    mismatching users mapped to ``{"stored": ..., "expected": ...}``."""
+    clock = summary_clock(now)
+    expected = await _compute_all(db, clock, user_id)
+    stored_query = {"_id": user_id} if user_id else {}
+    stored = {s['_id']: s async for s in db.fleet_summaries.find(stored_query)}
+
+    mismatches = {}
+    for uid in set(expected) | set(stored):
+        want = expected.get(uid) or empty_summary(uid, clock)
+        have = stored.get(uid)
+        have_counts = have and {k: have.get(k) for k in ('as_of', 'total_vehicles', 'buckets')}
+        want_counts = {k: want[k] for k in ('as_of', 'total_vehicles', 'buckets')}
+        if have_counts != want_counts and not (have is None and want['total_vehicles'] == 0):
+            mismatches[uid] = {"stored": have_counts, "expected": want_counts}
+
+    if fix:
+        for uid in mismatches:
+            await rebuild_user_summary(db, uid, now)
+    return mismatches
+
+
+async def roll_forward(db, now: Optional[datetime] = None, layout: str = 'dual') -> int:
+    """Move every summary to today's clock. Only vehicles whose expiry lies in
+    ``[old_clock, new_clock + window]`` can change bucket, so those are the
+    only ones read. ``layout`` is the vehicle layout being written; the
+    default matches vehicles in either. Returns the number of summaries adjusted."""
+    new_clock = summary_clock(now)
+    new_as_of = new_clock.isoformat()
+    old_clocks = await db.fleet_summaries.distinct("as_of", {"as_of": {"$lt": new_as_of}})
+
+    adjusted = 0
+    for old_as_of in old_clocks:
+        old_clock = datetime.fromisoformat(old_as_of)
+        deltas = defaultdict(lambda: defaultdict(int))
+        for doc_type in DOCUMENT_TYPES:
+            window = vehicle_documents.expiry_filter(doc_type, vehicle_documents.query_layout(layout), gte=old_as_of, lte=new_clock + EXPIRING_WINDOW)
+            async for vehicle in db.vehicles.find(window, _EXPIRY_PROJECTION):
+                expiry = vehicle_documents.expiries(vehicle)[doc_type]
+                before = classify_expiry(expiry, old_clock)
+                after = classify_expiry(expiry, new_clock)
+                if before != after:
+                    user_delta = deltas[vehicle['user_id']]
+                    user_delta[f"buckets.{doc_type}.{before}"] -= 1
+                    user_delta[f"buckets.{doc_type}.{after}"] += 1
+
+        updated_at = datetime.now(timezone.utc).isoformat()
+        ops = []
+        for uid, delta in deltas.items():
+            delta = {k: v for k, v in delta.items() if v}
+            if delta:
+                ops.append(UpdateOne(
+                    {"_id": uid, "as_of": old_as_of},
+                    {"$inc": {**delta, "revision": 1}, "$set": {"as_of": new_as_of, "updated_at": updated_at}}
+                ))
+        if ops:
+            result = await db.fleet_summaries.bulk_write(ops, ordered=False)
+            adjusted += result.modified_count
+        await db.fleet_summaries.update_many(
+            {"as_of": old_as_of},
+            {"$inc": {"revision": 1}, "$set": {"as_of": new_as_of, "updated_at": updated_at}}
+        )
+
+    logger.info(f"Fleet summaries rolled forward to {new_as_of} ({adjusted} adjusted)")
+    return adjusted
+
+
+def main(argv=None):
+    import argparse
+    import asyncio
+    import json
+    import os
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Rebuild, verify or roll forward fleet summaries")
+    parser.add_argument("command", choices=["rebuild", "verify", "roll"])
+    parser.add_argument("--user", help="limit to a single user id")
+    parser.add_argument("--fix", action="store_true", help="rebuild summaries that fail verification")
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    async def run():
+        if args.command == "rebuild":
+            print(f"Rebuilt {await rebuild_all(db, args.user)} summaries")
+            return 0
+        if args.command == "roll":
+            print(f"Adjusted {await roll_forward(db, layout=os.getenv('VEHICLE_LAYOUT', 'fields'))} summaries")
+            return 0
+        mismatches = await verify_all(db, args.user, fix=args.fix)
+        for uid, diff in mismatches.items():
+            print(json.dumps({"user_id": uid, **diff}, default=str))
+        print(f"{len(mismatches)} mismatched summaries" + (" (fixed)" if args.fix and mismatches else ""))
+        return 1 if mismatches and not args.fix else 0
+
+    try:
+        return asyncio.run(run())
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
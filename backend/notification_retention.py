@@ -0,0 +1,119 @@
+"""Retention for the ``notifications`` collection.
+
+Read notifications carry a BSON ``read_at`` date and expire through a TTL index
+after ``read_ttl_days``. Unread notifications older than ``archive_after_days``
+are moved by a daily job into ``notification_archive``, one compact document
+per user and month (``_id = "<user_id>:<YYYY-MM>"``), so the hot collection
+stays small. The server passes both values from ``AppConfig``
+(``NOTIFICATION_READ_TTL_DAYS``, ``NOTIFICATION_ARCHIVE_DAYS``).
+
+Archiving is safe to repeat: an item is pushed only if its id is not in the
+month yet, so a run that stops between archiving and deleting a batch picks
+it up again without duplicates. TTL deletes do not bump the user's data
+version, so list ETags include ``oldest_read_at``, which the TTL monitor
+changes whenever it deletes one of the user's notifications.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READ_TTL_DAYS = 30
+DEFAULT_ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_FIELDS = ['id', 'vehicle_id', 'title', 'message', 'notification_type', 'created_at']
+
+INDEX_OPTIONS_CONFLICT = 85
+
+
+async def ensure_indexes(db, read_ttl_days: int = DEFAULT_READ_TTL_DAYS):
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)], name="user_created_at")
+    await db.notifications.create_index([("user_id", 1), ("read_at", 1)], name="user_read_at")
+    await db.notifications.create_index("created_at", name="unread_created_at",
+                                        partialFilterExpression={"is_read": False})
+    expire_after = int(timedelta(days=read_ttl_days).total_seconds())
+    try:
+        await db.notifications.create_index("read_at", name="read_at_ttl", expireAfterSeconds=expire_after)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        await db.command({
+            "collMod": "notifications",
+            "index": {"name": "read_at_ttl", "expireAfterSeconds": expire_after},
+        })
+    await db.notification_archive.create_index([("user_id", 1), ("month", -1)], name="user_month")
+
+
+async def archive_stale(db, now: Optional[datetime] = None, archive_after_days: int = DEFAULT_ARCHIVE_AFTER_DAYS) -> set:
+    """Move unread notifications older than the cutoff into the monthly
+    archive. Returns the ids of users whose notifications changed."""
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=archive_after_days)).isoformat()
+
+    # Read notifications from before the TTL field existed would never expire.
+    await db.notifications.update_many(
+        {"is_read": True, "read_at": {"$exists": False}},
+        {"$set": {"read_at": now}}
+    )
+
+    users = set()
+    projection = {"_id": 0, "user_id": 1, **{f: 1 for f in ARCHIVE_FIELDS}}
+    while True:
+        batch = await db.notifications.find(
+            {"is_read": False, "created_at": {"$lt": cutoff}}, projection
+        ).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+
+        months = defaultdict(list)
+        for notif in batch:
+            months[(notif['user_id'], str(notif['created_at'])[:7])].append(
+                {f: notif.get(f) for f in ARCHIVE_FIELDS}
+            )
+        ops = []
+        for (user_id, month), items in months.items():
+            ops.append(UpdateOne(
+                {"_id": f"{user_id}:{month}"},
+                {"$setOnInsert": {"user_id": user_id, "month": month, "items": [], "count": 0}},
+                upsert=True
+            ))
+            ops.extend(
+                UpdateOne(
+                    {"_id": f"{user_id}:{month}", "items.id": {"$ne": item['id']}},
+                    {"$push": {"items": item}, "$inc": {"count": 1}}
+                )
+                for item in items
+            )
+        await db.notification_archive.bulk_write(ops)
+        await db.notifications.delete_many({"id": {"$in": [n['id'] for n in batch]}})
+        users.update(n['user_id'] for n in batch)
+
+    logger.info(f"Archived stale notifications for {len(users)} users")
+    return users
+
+
+async def oldest_read_at(db, user_id: str, session=None):
+    """``read_at`` of the user's next notification to expire, or None."""
+    oldest = await db.notifications.find_one(
+        {"user_id": user_id, "read_at": {"$exists": True}}, {"_id": 0, "read_at": 1},
+        sort=[("read_at", 1)], session=session
+    )
+    return oldest['read_at'] if oldest else None
+
+
+async def get_archive(db, user_id: str, before: Optional[str] = None, limit: int = 3, session=None) -> dict:
+    query = {"user_id": user_id}
+    if before:
+        query["month"] = {"$lt": before}
+    months = await db.notification_archive.find(query, {"_id": 0, "user_id": 0}, session=session).sort("month", -1).limit(limit).to_list(limit)
+    for month in months:
+        month['items'].sort(key=lambda n: n.get('created_at') or '', reverse=True)
+    return {
+        "months": months,
+        "next_before": months[-1]['month'] if len(months) == limit else None,
+    }
@@ -0,0 +1,246 @@
+"""Opt-in sampling profiler for single requests and scheduler jobs.
+
+A profiled run gets a background thread that samples the event loop thread
+every ``interval`` seconds. When the profiled task is running, the sample is
+its Python stack; when it is suspended, the sample is its ``await`` chain
+ending in ``[mongo wait]`` (a Mongo command issued by the run is in flight)
+or ``[await]``. Mongo time is measured exactly through a pymongo command
+listener that follows the run's context into Motor's executor threads.
+
+Output is the collapsed-stack format (``frame;frame;leaf count`` per line),
+which flamegraph.pl and speedscope open directly, plus a JSON sidecar with
+the totals.
+"""
+from collections import Counter
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import re
+import sys
+import threading
+import time
+import uuid
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID_PATTERN = re.compile(r'^\d+-[0-9a-f]{8}$')
+
+_active_profile: ContextVar[Optional["RunProfile"]] = ContextVar("active_profile", default=None)
+
+
+class RunProfile:
+    def __init__(self, name: str):
+        self.id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.stacks = Counter()
+        self.cpu_samples = 0
+        self.wait_samples = 0
+        self.mongo_wait_samples = 0
+        self.mongo_inflight = 0
+        self.mongo_time_us = 0
+        self.mongo_commands = Counter()
+        self.wall_time = 0.0
+        self.interval = 0.0
+        self._lock = threading.Lock()
+
+    def metadata(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "wall_ms": round(self.wall_time * 1000, 2),
+            "interval_ms": self.interval * 1000,
+            "samples": {"cpu": self.cpu_samples, "await": self.wait_samples, "mongo_wait": self.mongo_wait_samples},
+            "mongo_ms": round(self.mongo_time_us / 1000, 2),
+            "mongo_commands": dict(self.mongo_commands),
+        }
+
+
+class MongoWaitListener(monitoring.CommandListener):
+    """Charges command durations to the profile active in the issuing context."""
+
+    def started(self, event):
+        profile = _active_profile.get()
+        if profile is not None:
+            with profile._lock:
+                profile.mongo_inflight += 1
+                profile.mongo_commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        profile = _active_profile.get()
+        if profile is not None:
+            with profile._lock:
+                profile.mongo_inflight -= 1
+                profile.mongo_time_us += event.duration_micros
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def _await_chain(coro) -> List[str]:
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return labels
+
+
+def _running_stack(frame, root_code) -> List[str]:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        if frame.f_code is root_code:
+            break
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profile: RunProfile, task: asyncio.Task, interval: float):
+        super().__init__(name=f"profiler-{profile.id}", daemon=True)
+        self.profile = profile
+        self.task = task
+        self.loop = task.get_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.interval = interval
+        self.root_code = task.get_coro().cr_code
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        profile = self.profile
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = _running_stack(frame, self.root_code)
+            profile.cpu_samples += 1
+        else:
+            stack = _await_chain(self.task.get_coro())
+            if profile.mongo_inflight > 0:
+                stack.append("[mongo wait]")
+                profile.mongo_wait_samples += 1
+            else:
+                stack.append("[await]")
+                profile.wait_samples += 1
+        if stack:
+            profile.stacks[";".join(stack)] += 1
+
+
+class ProfileStore:
+    def __init__(self, directory: Path, keep: int = 50):
+        self.directory = Path(directory)
+        self.keep = keep
+
+    def save(self, profile: RunProfile):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lines = [f"{stack} {count}" for stack, count in profile.stacks.most_common()]
+        (self.directory / f"{profile.id}.collapsed").write_text("\n".join(lines) + "\n")
+        (self.directory / f"{profile.id}.json").write_text(json.dumps(profile.metadata()))
+        for stale in self._metadata_files()[self.keep:]:
+            stale.unlink(missing_ok=True)
+            stale.with_suffix(".collapsed").unlink(missing_ok=True)
+
+    def _metadata_files(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob("*.json"), reverse=True)
+
+    def list(self, limit: int = 50) -> List[dict]:
+        return [json.loads(path.read_text()) for path in self._metadata_files()[:limit]]
+
+    def path(self, profile_id: str) -> Optional[Path]:
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.collapsed"
+        return path if path.exists() else None
+
+
+@asynccontextmanager
+async def profile_run(name: str, store: ProfileStore, interval: float = 0.005):
+    """Profile the current task until the block exits, then save it."""
+    profile = RunProfile(name)
+    profile.interval = interval
+    context_token = _active_profile.set(profile)
+    sampler = _Sampler(profile, asyncio.current_task(), interval)
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        yield profile
+    finally:
+        sampler.stopped.set()
+        profile.wall_time = time.perf_counter() - started
+        _active_profile.reset(context_token)
+        sampler.join()
+        try:
+            await asyncio.to_thread(store.save, profile)
+        except OSError as e:
+            logger.error(f"Failed to save profile {profile.id}: {e}")
+
+
+def profiled_job(func, name: str, store: ProfileStore, interval: float = 0.005):
+    async def run(*args, **kwargs):
+        async with profile_run(name, store, interval):
+            return await func(*args, **kwargs)
+    run.__name__ = func.__name__
+    return run
+
+
+class ProfilingMiddleware:
+    """Profiles requests carrying ``X-Profile-Token`` equal to the configured
+    token, and 1 in ``sample_rate`` requests otherwise. The token is only read
+    from the header: query strings end up in access logs."""
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str] = None,
+                 sample_rate: int = 0, interval: float = 0.005, exclude_prefix: str = "/api/profiles"):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.exclude_prefix = exclude_prefix
+        self._counter = itertools.count(1)
+
+    def _requested(self, scope) -> bool:
+        if not self.token:
+            return False
+        token = self.token.encode()
+        headers = dict(scope.get("headers") or [])
+        return hmac.compare_digest(headers.get(b"x-profile-token", b""), token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefix):
+            return await self.app(scope, receive, send)
+        sampled = self.sample_rate > 0 and next(self._counter) % self.sample_rate == 0
+        if not (sampled or self._requested(scope)):
+            return await self.app(scope, receive, send)
+
+        async with profile_run(f"{scope['method']} {scope['path']}", self.store, self.interval) as profile:
+            async def send_with_profile_id(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+                await send(message)
+            await self.app(scope, receive, send_with_profile_id)
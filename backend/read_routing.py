@@ -0,0 +1,115 @@
+"""Per-endpoint read preference routing.
+
+Read-dominated paths are grouped into read classes (``dashboard``, ``lists``,
+``scan``), each served by a database handle with its own read preference and
+optional ``maxStalenessSeconds``. Writes and read-after-write paths stay on the
+primary handle.
+
+Routed reads run in a causally consistent session. Request handlers read the
+user's data version from the primary first, which advances the session's
+operation time past the user's last write; the routed read that follows then
+waits for a secondary that has caught up to it (``afterClusterTime``), so users
+still read their own writes while the bulk of the read moves off the primary.
+
+A command listener counts which node served each read, per read class. Reads
+a routed request sends to the primary on purpose, such as the version read,
+run inside ``primary_reads()`` and count under ``primary``.
+
+``maxStalenessSeconds`` is either -1 (no limit) or at least
+``MIN_MAX_STALENESS_SECONDS``; the driver rejects anything smaller.
+"""
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+READ_COMMANDS = {"find", "getMore", "aggregate", "count", "distinct"}
+MIN_MAX_STALENESS_SECONDS = 90
+
+DEFAULT_READ_PREFERENCES = {
+    "dashboard": "secondaryPreferred",
+    "lists": "nearest",
+    "scan": "secondaryPreferred",
+}
+
+_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+_read_class: ContextVar[str] = ContextVar("read_class", default="primary")
+
+
+@contextmanager
+def primary_reads():
+    """Count the reads in this block under ``primary`` whatever the
+    enclosing read class, for reads that go to the primary handle."""
+    token = _read_class.set("primary")
+    try:
+        yield
+    finally:
+        _read_class.reset(token)
+
+
+def validate_max_staleness(seconds: int) -> int:
+    if seconds != -1 and seconds < MIN_MAX_STALENESS_SECONDS:
+        raise ValueError(f"max staleness must be -1 (disabled) or at least {MIN_MAX_STALENESS_SECONDS} seconds")
+    return seconds
+
+
+def read_preference(mode: str, max_staleness: int = -1):
+    if mode not in _MODES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode == "primary":
+        return Primary()
+    return _MODES[mode](max_staleness=max_staleness)
+
+
+class ReadNodeListener(monitoring.CommandListener):
+    def __init__(self):
+        self.counts = Counter()
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name in READ_COMMANDS:
+            host, port = event.connection_id
+            self.counts[(_read_class.get(), f"{host}:{port}")] += 1
+
+    def failed(self, event):
+        pass
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        nodes = defaultdict(dict)
+        for (read_class, node), count in self.counts.items():
+            nodes[read_class][node] = count
+        return dict(nodes)
+
+
+class ReadRouter:
+    def __init__(self, client, db_name: str, preferences: Optional[dict] = None, max_staleness: int = -1):
+        self.client = client
+        self.primary = client[db_name]
+        self.databases = {
+            read_class: client.get_database(db_name, read_preference=read_preference(mode, max_staleness))
+            for read_class, mode in {**DEFAULT_READ_PREFERENCES, **(preferences or {})}.items()
+        }
+
+    def database(self, read_class: str):
+        return self.databases.get(read_class, self.primary)
+
+    @asynccontextmanager
+    async def session(self, read_class: str = "primary"):
+        token = _read_class.set(read_class)
+        try:
+            async with await self.client.start_session(causal_consistency=True) as session:
+                yield session
+        finally:
+            _read_class.reset(token)
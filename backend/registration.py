@@ -0,0 +1,152 @@
+"""Registration number identity for vehicles.
+
+A vehicle is identified within a user's fleet by its normalized registration
+number (upper-case, letters and digits only), stored as
+``normalized_registration`` and protected by a unique ``(user_id,
+normalized_registration)`` index.
+
+Usage::
+
+    python registration.py dedupe [--dry-run]
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+import logging
+import re
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+import fleet_summary
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FIELDS = [
+    'vehicle_type', 'owner_name', 'manufacturer', 'model', 'year',
+    'road_tax_expiry', 'insurance_expiry', 'puc_expiry', 'fitness_expiry', 'documents',
+]
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]')
+
+
+def normalize_registration(registration_number: str) -> str:
+    return _NON_ALNUM.sub('', registration_number.upper())
+
+
+async def ensure_registration_index(db) -> bool:
+    """Backfill ``normalized_registration`` on vehicles stored without it and
+    create the unique registration index. Returns False (and logs) if
+    existing duplicates prevent it; run ``registration.py dedupe`` first.
+
+    Without the backfill, older vehicles would fall outside both the partial
+    index and the lookups by normalized registration, so a re-added vehicle
+    would be created a second time."""
+    backfilled = await backfill_normalized(db)
+    if backfilled:
+        logger.info(f"Backfilled normalized registrations on {backfilled} vehicles")
+    try:
+        await db.vehicles.create_index(
+            [("user_id", 1), ("normalized_registration", 1)],
+            name="user_registration_unique",
+            unique=True,
+            partialFilterExpression={"normalized_registration": {"$type": "string"}},
+        )
+        return True
+    except OperationFailure as e:
+        logger.error(f"Could not create unique registration index, run `python registration.py dedupe`: {e}")
+        return False
+
+
+async def backfill_normalized(db) -> int:
+    ops = []
+    async for vehicle in db.vehicles.find({"normalized_registration": {"$exists": False}},
+                                          {"_id": 0, "id": 1, "registration_number": 1}):
+        ops.append(UpdateOne(
+            {"id": vehicle['id']},
+            {"$set": {"normalized_registration": normalize_registration(vehicle['registration_number'])}}
+        ))
+    if ops:
+        await db.vehicles.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def dedupe(db, dry_run: bool = False) -> dict:
+    """Merge vehicles sharing ``(user_id, normalized_registration)``.
+
+    The oldest document survives and takes the registry fields of the most
+    recently updated duplicate; notifications pointing at removed duplicates
+    are re-pointed at the survivor.
+    """
+    backfilled = 0 if dry_run else await backfill_normalized(db)
+
+    groups = defaultdict(list)
+    projection = {"_id": 0, "id": 1, "user_id": 1, "registration_number": 1,
+                  "normalized_registration": 1, "created_at": 1, "updated_at": 1, **{f: 1 for f in REGISTRY_FIELDS}}
+    async for vehicle in db.vehicles.find({}, projection):
+        normalized = vehicle.get('normalized_registration') or normalize_registration(vehicle['registration_number'])
+        groups[(vehicle['user_id'], normalized)].append(vehicle)
+
+    merged_users = set()
+    removed = 0
+    for (user_id, normalized), vehicles in groups.items():
+        if len(vehicles) < 2:
+            continue
+        vehicles.sort(key=lambda v: str(v.get('created_at') or ''))
+        survivor, losers = vehicles[0], vehicles[1:]
+        freshest = max(vehicles, key=lambda v: str(v.get('updated_at') or ''))
+        loser_ids = [v['id'] for v in losers]
+        logger.info(f"{user_id}/{normalized}: keeping {survivor['id']}, merging {loser_ids}")
+        merged_users.add(user_id)
+        removed += len(losers)
+        if dry_run:
+            continue
+
+        if freshest is not survivor:
+            # The duplicates may predate a layout change; take the freshest
+            # one's layout too, so no stale expiry copy survives the merge.
+            update = {"$set": {**{f: freshest[f] for f in REGISTRY_FIELDS if f in freshest},
+                               "updated_at": datetime.now(timezone.utc).isoformat()}}
+            stale = [f for f in REGISTRY_FIELDS if f not in freshest and f in survivor]
+            if stale:
+                update["$unset"] = {f: "" for f in stale}
+            await db.vehicles.update_one({"id": survivor['id']}, update)
+        await db.notifications.update_many({"vehicle_id": {"$in": loser_ids}}, {"$set": {"vehicle_id": survivor['id']}})
+        await db.vehicles.delete_many({"id": {"$in": loser_ids}})
+
+    if not dry_run:
+        for user_id in merged_users:
+            await fleet_summary.rebuild_user_summary(db, user_id)
+            await db.data_versions.update_one({"_id": user_id}, {"$inc": {"version": 1}}, upsert=True)
+        await ensure_registration_index(db)
+
+    return {"backfilled": backfilled, "users": len(merged_users), "removed": removed}
+
+
+def main(argv=None):
+    import argparse
+    import asyncio
+    import os
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Merge duplicate vehicles and create the unique registration index")
+    parser.add_argument("command", choices=["dedupe"])
+    parser.add_argument("--dry-run", action="store_true", help="report duplicates without changing anything")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        result = asyncio.run(dedupe(db, dry_run=args.dry_run))
+    finally:
+        client.close()
+    print(f"Backfilled {result['backfilled']}, removed {result['removed']} duplicates across {result['users']} users"
+          + (" (dry run)" if args.dry_run else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,254 @@
+"""Clients for the upstream vehicle registry.
+
+``create_registry_client(config)`` picks a provider from the app config's
+``registry_provider`` (``REGISTRY_PROVIDER``):
+
+* ``mock`` (default) - synthetic data, no network.
+* ``http`` - ``GET {registry_url}/vehicles/{registration_number}`` over a pooled
+  keep-alive connection, with per-attempt timeouts, hedged retries and a
+  circuit breaker.
+
+Every provider returns the same payload shape: ``registration_number``,
+``vehicle_type``, ``manufacturer``, ``model``, ``year``, ``owner_name`` and the
+four ``*_expiry`` fields as ISO-8601 strings. The HTTP client checks upstream
+payloads against it and raises ``RegistryError`` for anything else.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RegistryError(Exception):
+    pass
+
+
+class RegistryNotFound(RegistryError):
+    pass
+
+
+class RegistryUnavailable(RegistryError):
+    def __init__(self, message: str, retry_after: float = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+STRING_FIELDS = ["registration_number", "vehicle_type", "manufacturer", "model", "owner_name"]
+EXPIRY_FIELDS = ["road_tax_expiry", "insurance_expiry", "puc_expiry", "fitness_expiry"]
+
+
+def validate_payload(payload) -> dict:
+    """Return ``payload`` if it has the shape every provider returns, else
+    raise ``RegistryError`` naming the first offending field."""
+    if not isinstance(payload, dict):
+        raise RegistryError(f"registry returned {type(payload).__name__}, expected an object")
+    for field in STRING_FIELDS:
+        if not isinstance(payload.get(field), str):
+            raise RegistryError(f"registry payload has no valid {field}")
+    if not isinstance(payload.get("year"), int) or isinstance(payload["year"], bool):
+        raise RegistryError("registry payload has no valid year")
+    for field in EXPIRY_FIELDS:
+        try:
+            datetime.fromisoformat(payload[field])
+        except (KeyError, TypeError, ValueError):
+            raise RegistryError(f"registry payload has no valid {field}") from None
+    return payload
+
+
+class VehicleRegistryClient(ABC):
+    @abstractmethod
+    async def lookup(self, registration_number: str) -> dict:
+        ...
+
+    async def aclose(self):
+        pass
+
+
+class MockRegistryClient(VehicleRegistryClient):
+    manufacturers = ["TATA", "Ashok Leyland", "Mahindra", "Eicher", "BharatBenz"]
+    models = ["LPT 1918", "2518", "Blazo X", "Pro 6025", "1617R"]
+
+    async def lookup(self, registration_number: str) -> dict:
+        base_date = datetime.now(timezone.utc)
+
+        days_offset_road_tax = random.randint(-30, 90)
+        days_offset_insurance = random.randint(-30, 120)
+        days_offset_puc = random.randint(-30, 60)
+
+        return {
+            "registration_number": registration_number.upper(),
+            "vehicle_type": "Commercial Vehicle",
+            "manufacturer": random.choice(self.manufacturers),
+            "model": random.choice(self.models),
+            "year": random.randint(2015, 2024),
+            "owner_name": "Fleet Owner",
+            "road_tax_expiry": (base_date + timedelta(days=days_offset_road_tax)).isoformat(),
+            "insurance_expiry": (base_date + timedelta(days=days_offset_insurance)).isoformat(),
+            "puc_expiry": (base_date + timedelta(days=days_offset_puc)).isoformat(),
+            "fitness_expiry": (base_date + timedelta(days=365)).isoformat(),
+        }
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failed calls and rejects
+    calls for ``reset_timeout`` seconds, then lets a single probe through."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self.probing):
+            retry_after = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise RegistryUnavailable("Vehicle registry circuit is open", retry_after=max(retry_after, 1))
+        if state == "half-open":
+            self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logger.warning(f"Vehicle registry circuit opened after {self.failures} failures")
+
+    def end_call(self):
+        """Release the half-open probe slot. A probe that was cancelled before
+        it produced an outcome leaves the breaker half-open for the next call."""
+        self.probing = False
+
+
+class _RetryableError(RegistryError):
+    pass
+
+
+class HttpRegistryClient(VehicleRegistryClient):
+    def __init__(self, base_url: str, timeout: float = 2.0, hedge_delay: float = 0.3,
+                 max_attempts: int = 3, max_connections: int = 50, api_key: str = None,
+                 breaker: CircuitBreaker = None):
+        import httpx
+
+        self._httpx = httpx
+        self.hedge_delay = hedge_delay
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 1.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else None,
+        )
+
+    async def _attempt(self, registration_number: str) -> dict:
+        httpx = self._httpx
+        try:
+            response = await self.client.get(f"/vehicles/{quote(registration_number, safe='')}")
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise _RetryableError(f"{type(e).__name__}: {e}") from e
+        if response.status_code == 404:
+            raise RegistryNotFound(registration_number)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise _RetryableError(f"registry returned {response.status_code}")
+        if response.status_code >= 400:
+            raise RegistryError(f"registry returned {response.status_code}")
+        try:
+            payload = response.json()
+        except ValueError as e:
+            raise RegistryError(f"registry returned invalid JSON: {e}") from e
+        return validate_payload(payload)
+
+    async def _hedged(self, registration_number: str) -> dict:
+        """Start an attempt, and another whenever the in-flight ones have been
+        silent for ``hedge_delay`` or one failed retryably, up to
+        ``max_attempts``. The first success wins; the rest are cancelled."""
+        pending = set()
+        attempts = 0
+        last_error = None
+        try:
+            while True:
+                if attempts < self.max_attempts and (not pending or last_error is not None):
+                    pending.add(asyncio.create_task(self._attempt(registration_number)))
+                    attempts += 1
+                    last_error = None
+                if not pending:
+                    raise RegistryUnavailable(f"Vehicle registry failed after {attempts} attempts")
+
+                wait = self.hedge_delay if attempts < self.max_attempts else None
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    pending.add(asyncio.create_task(self._attempt(registration_number)))
+                    attempts += 1
+                    continue
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    if not isinstance(error, _RetryableError):
+                        raise error
+                    logger.warning(f"Registry attempt for {registration_number} failed: {error}")
+                    last_error = error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def lookup(self, registration_number: str) -> dict:
+        self.breaker.before_call()
+        try:
+            result = await self._hedged(registration_number)
+        except RegistryNotFound:
+            self.breaker.record_success()
+            raise
+        except Exception:
+            # Unexpected errors (e.g. a malformed body) count as failures too.
+            self.breaker.record_failure()
+            raise
+        finally:
+            self.breaker.end_call()
+        self.breaker.record_success()
+        return result
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def create_registry_client(config) -> VehicleRegistryClient:
+    """Build the client for ``config``, an ``AppConfig``."""
+    if config.registry_provider == 'mock':
+        return MockRegistryClient()
+    if config.registry_provider == 'http':
+        if not config.registry_url:
+            raise ValueError("REGISTRY_URL is required for the http registry provider")
+        return HttpRegistryClient(
+            base_url=config.registry_url,
+            timeout=config.registry_timeout,
+            hedge_delay=config.registry_hedge_delay,
+            max_attempts=config.registry_max_attempts,
+            max_connections=config.registry_max_connections,
+            api_key=config.registry_api_key,
+            breaker=CircuitBreaker(
+                failure_threshold=config.registry_breaker_threshold,
+                reset_timeout=config.registry_breaker_reset,
+            ),
+        )
+    raise ValueError(f"Unknown REGISTRY_PROVIDER: {config.registry_provider}")
@@ -0,0 +1,48 @@
+"""Local stand-in for the vehicle registry with configurable latency and
+failures, for reproducing upstream slowness against the ``http`` provider.
+
+    python registry_stub.py --port 8099 --latency-ms 250 --jitter-ms 100 --error-rate 0.1
+    REGISTRY_PROVIDER=http REGISTRY_URL=http://localhost:8099 uvicorn server:app
+"""
+import asyncio
+import os
+import random
+
+from fastapi import FastAPI, HTTPException
+
+from registry_client import MockRegistryClient
+
+LATENCY_MS = float(os.getenv('REGISTRY_STUB_LATENCY_MS', '100'))
+JITTER_MS = float(os.getenv('REGISTRY_STUB_JITTER_MS', '0'))
+ERROR_RATE = float(os.getenv('REGISTRY_STUB_ERROR_RATE', '0'))
+
+app = FastAPI(title="Vehicle Registry Stub")
+mock = MockRegistryClient()
+
+
+@app.get("/vehicles/{registration_number}")
+async def lookup_vehicle(registration_number: str):
+    await asyncio.sleep(max(LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS), 0) / 1000)
+    if random.random() < ERROR_RATE:
+        raise HTTPException(status_code=503, detail="Registry unavailable")
+    return await mock.lookup(registration_number)
+
+
+def main(argv=None):
+    import argparse
+    import uvicorn
+
+    global LATENCY_MS, JITTER_MS, ERROR_RATE
+    parser = argparse.ArgumentParser(description="Run the vehicle registry stub")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE)
+    args = parser.parse_args(argv)
+
+    LATENCY_MS, JITTER_MS, ERROR_RATE = args.latency_ms, args.jitter_ms, args.error_rate
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
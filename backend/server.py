@@ -1,41 +1,123 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, BackgroundTasks, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import List, Optional
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, TypeAdapter, field_validator
+from typing import List, Literal, Optional
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from dotenv import load_dotenv
 from pathlib import Path
+from contextlib import asynccontextmanager
+from functools import lru_cache
 import os
 import uuid
+import hashlib
+import hmac
+import json
+import asyncio
 import logging
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import fleet_summary
+import registration
+import notification_retention
+import vehicle_documents
+from registry_client import create_registry_client, RegistryError, RegistryNotFound, RegistryUnavailable
+from profiler import MongoWaitListener, ProfileStore, ProfilingMiddleware, profiled_job
+from admission import AdmissionController, MongoBucketStore, build_policies, client_address, parse_networks, parse_trusted_proxies
+from read_routing import ReadNodeListener, ReadRouter, primary_reads, validate_max_staleness
+from compression import CompressionMiddleware, strip_encoding_suffix
+from settings_store import SettingsStore
+from batch import BatchContext, batch_context, run_batch
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-app = FastAPI(title="FleetCare API")
 api_router = APIRouter(prefix="/api")
 
 SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'fleetcare-secret-key-change-in-production')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class AppConfig(BaseModel):
+    mongo_url: str
+    db_name: str
+    cors_origins: List[str] = ["*"]
+    enable_scheduler: bool = True
+    profiler_token: Optional[str] = None
+    profile_sample_rate: int = 0
+    profile_interval_ms: float = 5.0
+    profile_jobs: bool = False
+    profile_dir: str = str(ROOT_DIR / 'profiles')
+    admission_enabled: bool = True
+    admission_store: Literal["memory", "mongo"] = "memory"
+    admission_policies: dict = {}
+    trusted_proxies: Optional[List[str]] = None
+    read_preferences: dict = {}
+    max_staleness_seconds: int = -1
+    compression_min_size: int = 1024
+    settings_cache_ttl: float = 60.0
+    batch_max_size: int = 10
+    notification_read_ttl_days: int = notification_retention.DEFAULT_READ_TTL_DAYS
+    notification_archive_days: int = notification_retention.DEFAULT_ARCHIVE_AFTER_DAYS
+    vehicle_layout: Literal["fields", "dual", "documents"] = "fields"
+    registry_provider: Literal["mock", "http"] = "mock"
+    registry_url: Optional[str] = None
+    registry_timeout: float = 2.0
+    registry_hedge_delay: float = 0.3
+    registry_max_attempts: int = 3
+    registry_max_connections: int = 50
+    registry_api_key: Optional[str] = None
+    registry_breaker_threshold: int = 5
+    registry_breaker_reset: float = 30.0
+
+    @field_validator('max_staleness_seconds')
+    @classmethod
+    def check_max_staleness(cls, value: int) -> int:
+        return validate_max_staleness(value)
+
+    @classmethod
+    def from_env(cls) -> "AppConfig":
+        return cls(
+            mongo_url=os.environ['MONGO_URL'],
+            db_name=os.environ['DB_NAME'],
+            cors_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+            enable_scheduler=os.environ.get('ENABLE_SCHEDULER', 'true').lower() in ('1', 'true', 'yes'),
+            profiler_token=os.environ.get('PROFILER_TOKEN') or None,
+            profile_sample_rate=int(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+            profile_interval_ms=float(os.environ.get('PROFILE_INTERVAL_MS', '5')),
+            profile_jobs=os.environ.get('PROFILE_JOBS', 'false').lower() in ('1', 'true', 'yes'),
+            profile_dir=os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')),
+            admission_enabled=os.environ.get('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            admission_store=os.environ.get('ADMISSION_STORE', 'memory'),
+            admission_policies=json.loads(os.environ.get('ADMISSION_POLICIES', '{}')),
+            trusted_proxies=parse_trusted_proxies(os.environ.get('TRUSTED_PROXIES')),
+            read_preferences=json.loads(os.environ.get('READ_PREFERENCES', '{}')),
+            max_staleness_seconds=int(os.environ.get('MAX_STALENESS_SECONDS', '-1')),
+            compression_min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+            settings_cache_ttl=float(os.environ.get('SETTINGS_CACHE_TTL', '60')),
+            batch_max_size=int(os.environ.get('BATCH_MAX_SIZE', '10')),
+            notification_read_ttl_days=int(os.environ.get('NOTIFICATION_READ_TTL_DAYS', '30')),
+            notification_archive_days=int(os.environ.get('NOTIFICATION_ARCHIVE_DAYS', '90')),
+            vehicle_layout=os.environ.get('VEHICLE_LAYOUT', 'fields'),
+            registry_provider=os.environ.get('REGISTRY_PROVIDER', 'mock'),
+            registry_url=os.environ.get('REGISTRY_URL') or None,
+            registry_timeout=float(os.environ.get('REGISTRY_TIMEOUT', '2.0')),
+            registry_hedge_delay=float(os.environ.get('REGISTRY_HEDGE_DELAY', '0.3')),
+            registry_max_attempts=int(os.environ.get('REGISTRY_MAX_ATTEMPTS', '3')),
+            registry_max_connections=int(os.environ.get('REGISTRY_MAX_CONNECTIONS', '50')),
+            registry_api_key=os.environ.get('REGISTRY_API_KEY') or None,
+            registry_breaker_threshold=int(os.environ.get('REGISTRY_BREAKER_THRESHOLD', '5')),
+            registry_breaker_reset=float(os.environ.get('REGISTRY_BREAKER_RESET', '30')),
+        )
+
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -75,11 +157,15 @@ class Vehicle(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+ConflictMode = Literal["return", "refresh", "error"]
+
 class VehicleCreate(BaseModel):
     registration_number: str
+    on_conflict: ConflictMode = "return"
 
 class VehicleBulkCreate(BaseModel):
     registration_numbers: List[str]
+    on_conflict: ConflictMode = "return"
 
 class Notification(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -100,7 +186,7 @@ class UserSettings(BaseModel):
     push_notifications: bool = False
     notification_days_before: int = 15
     notification_time: str = "09:00"
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
 
 class UserSettingsUpdate(BaseModel):
     email_notifications: Optional[bool] = None
@@ -108,12 +194,60 @@ class UserSettingsUpdate(BaseModel):
     notification_days_before: Optional[int] = None
     notification_time: Optional[str] = None
 
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    path: str
+    if_none_match: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+class Runtime:
+    """Connections and caches owned by one app's lifespan, kept on
+    ``app.state.runtime``. Handlers reach it through ``get_runtime``."""
+    def __init__(self, config: Optional[AppConfig] = None, client=None, db=None, read_router=None,
+                 read_node_listener=None, settings_store=None, registry_client=None):
+        self.config = config
+        self.client = client
+        self.db = db
+        self.read_router = read_router
+        self.read_node_listener = read_node_listener
+        self.settings_store = settings_store
+        self.registry_client = registry_client
+
+    @classmethod
+    def open(cls, config: AppConfig) -> "Runtime":
+        read_node_listener = ReadNodeListener()
+        client = AsyncIOMotorClient(config.mongo_url, event_listeners=[MongoWaitListener(), read_node_listener])
+        db = client[config.db_name]
+        return cls(
+            config=config,
+            client=client,
+            db=db,
+            read_router=ReadRouter(client, config.db_name, config.read_preferences, config.max_staleness_seconds),
+            read_node_listener=read_node_listener,
+            settings_store=SettingsStore(db.settings, UserSettings, ttl=config.settings_cache_ttl),
+            registry_client=create_registry_client(config),
+        )
+
+    async def close(self):
+        await self.registry_client.aclose()
+        self.client.close()
+
+def get_runtime(request: Request) -> Runtime:
+    return request.app.state.runtime
+
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -125,7 +259,11 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    context = batch_context.get()
+    if context is not None:
+        return context.user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -140,34 +278,84 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = await get_runtime(request).db.users.find_one({"id": user_id}, {"_id": 0})
     if user is None:
         raise credentials_exception
     return User(**user)
 
-async def mock_vehicle_api(registration_number: str) -> dict:
-    import random
-    base_date = datetime.now(timezone.utc)
-    
-    manufacturers = ["TATA", "Ashok Leyland", "Mahindra", "Eicher", "BharatBenz"]
-    models = ["LPT 1918", "2518", "Blazo X", "Pro 6025", "1617R"]
-    
-    days_offset_road_tax = random.randint(-30, 90)
-    days_offset_insurance = random.randint(-30, 120)
-    days_offset_puc = random.randint(-30, 60)
-    
-    return {
-        "registration_number": registration_number.upper(),
-        "vehicle_type": "Commercial Vehicle",
-        "manufacturer": random.choice(manufacturers),
-        "model": random.choice(models),
-        "year": random.randint(2015, 2024),
-        "owner_name": "Fleet Owner",
-        "road_tax_expiry": (base_date + timedelta(days=days_offset_road_tax)).isoformat(),
-        "insurance_expiry": (base_date + timedelta(days=days_offset_insurance)).isoformat(),
-        "puc_expiry": (base_date + timedelta(days=days_offset_puc)).isoformat(),
-        "fitness_expiry": (base_date + timedelta(days=365)).isoformat(),
-    }
+def admission_caller(request: Request) -> Optional[str]:
+    """Rate limit key for the request: the user for authenticated calls, the
+    client address for anonymous ones, or None while the deployment has not
+    said which proxies to trust (the peer may then be the ingress)."""
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            user_id = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            if user_id:
+                return f"user:{user_id}"
+        except JWTError:
+            pass
+    if request.app.state.trusted_proxies is None:
+        return None
+    peer = request.client.host if request.client else None
+    return f"ip:{client_address(peer, request.headers.get('x-forwarded-for'), request.app.state.trusted_proxies)}"
+
+def admit(endpoint_class: str):
+    async def dependency(request: Request):
+        controller = request.app.state.admission
+        if controller is None:
+            yield
+            return
+        async with controller.admit(endpoint_class, admission_caller(request)):
+            yield
+    return Depends(dependency)
+
+def read_session(read_class: str):
+    async def dependency(request: Request):
+        async with get_runtime(request).read_router.session(read_class) as session:
+            yield session
+    return Depends(dependency)
+
+async def get_data_version(db, user_id: str, session=None) -> int:
+    with primary_reads():
+        doc = await db.data_versions.find_one({"_id": user_id}, session=session)
+    return doc['version'] if doc else 0
+
+async def bump_data_version(db, user_id: str):
+    await db.data_versions.update_one({"_id": user_id}, {"$inc": {"version": 1}}, upsert=True)
+
+def make_etag(user_id: str, version: int, *parts) -> str:
+    digest = hashlib.sha1("|".join([user_id, *map(str, parts)]).encode()).hexdigest()[:16]
+    return f'"{digest}-{version}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [strip_encoding_suffix(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+async def conditional_get(request: Request, response: Response, user_id: str, *parts, session=None) -> Optional[Response]:
+    """Return a 304 response if the client's cached copy is current, otherwise
+    set the ETag on ``response`` and return None. Must run before the query so
+    a concurrent write can only make the ETag older than the body, never newer.
+    The version is read from the primary; in a causal ``session`` this also
+    makes later routed reads at least as fresh as the user's last write.
+    Inside a batch, the version the batch read up front is used instead."""
+    context = batch_context.get()
+    if context is not None and context.user.id == user_id:
+        version = context.data_version
+        if session is not None:
+            context.advance(session)
+    else:
+        version = await get_data_version(get_runtime(request).db, user_id, session=session)
+    request.state.data_version = version
+    etag = make_etag(user_id, version, request.url.path, request.url.query, *parts)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
 
 async def send_email_notification(to_email: str, subject: str, message: str):
     sendgrid_key = os.getenv('SENDGRID_API_KEY')
@@ -178,6 +366,9 @@ async def send_email_notification(to_email: str, subject: str, message: str):
         return
     
     try:
+        from sendgrid import SendGridAPIClient
+        from sendgrid.helpers.mail import Mail
+        
         email_message = Mail(
             from_email=sender_email,
             to_emails=to_email,
@@ -190,8 +381,9 @@ async def send_email_notification(to_email: str, subject: str, message: str):
     except Exception as e:
         logger.error(f"Failed to send email: {str(e)}")
 
-@api_router.post("/auth/signup", response_model=Token)
-async def signup(user_create: UserCreate):
+@api_router.post("/auth/signup", response_model=Token, dependencies=[admit("login")])
+async def signup(user_create: UserCreate, runtime: Runtime = Depends(get_runtime)):
+    db = runtime.db
     existing_user = await db.users.find_one({"email": user_create.email}, {"_id": 0})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -213,9 +405,9 @@ async def signup(user_create: UserCreate):
         user={"id": user.id, "email": user.email, "name": user.name}
     )
 
-@api_router.post("/auth/login", response_model=Token)
-async def login(user_login: UserLogin):
-    user = await db.users.find_one({"email": user_login.email}, {"_id": 0})
+@api_router.post("/auth/login", response_model=Token, dependencies=[admit("login")])
+async def login(user_login: UserLogin, runtime: Runtime = Depends(get_runtime)):
+    user = await runtime.db.users.find_one({"email": user_login.email}, {"_id": 0})
     if not user or not verify_password(user_login.password, user['hashed_password']):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -235,8 +427,9 @@ class GoogleAuthRequest(BaseModel):
     name: str
     uid: str
 
-@api_router.post("/auth/google", response_model=Token)
-async def google_auth(auth_request: GoogleAuthRequest):
+@api_router.post("/auth/google", response_model=Token, dependencies=[admit("login")])
+async def google_auth(auth_request: GoogleAuthRequest, runtime: Runtime = Depends(get_runtime)):
+    db = runtime.db
     user = await db.users.find_one({"email": auth_request.email}, {"_id": 0})
     
     if not user:
@@ -259,221 +452,365 @@ async def google_auth(auth_request: GoogleAuthRequest):
     )
 
 
+@api_router.get("/health")
+async def health():
+    return {"status": "ok"}
+
 @api_router.get("/auth/me")
 async def get_me(current_user: User = Depends(get_current_user)):
     return {"id": current_user.id, "email": current_user.email, "name": current_user.name}
 
-@api_router.post("/vehicles", response_model=Vehicle)
-async def add_vehicle(
-    vehicle_create: VehicleCreate,
-    current_user: User = Depends(get_current_user)
-):
-    vehicle_data = await mock_vehicle_api(vehicle_create.registration_number)
-    
+def parse_vehicle_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in Vehicle.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(["id", *requested]))
+
+def vehicle_projection(selected: Optional[List[str]]) -> dict:
+    if not selected:
+        return {"_id": 0}
+    return {"_id": 0, **vehicle_documents.projection(selected)}
+
+def sparse_response(response: Response, content) -> JSONResponse:
+    """Return projected documents as-is, skipping model validation and the
+    fields the client did not ask for."""
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return JSONResponse(content=content, headers=headers)
+
+VEHICLE_DATE_FIELDS = ['created_at', 'updated_at', *vehicle_documents.EXPIRY_FIELDS]
+
+def build_vehicle(user_id: str, vehicle_data: dict, layout: str) -> tuple:
     vehicle = Vehicle(
-        user_id=current_user.id,
+        user_id=user_id,
         registration_number=vehicle_data['registration_number'],
         vehicle_type=vehicle_data['vehicle_type'],
         owner_name=vehicle_data['owner_name'],
         manufacturer=vehicle_data['manufacturer'],
         model=vehicle_data['model'],
         year=vehicle_data['year'],
-        road_tax_expiry=datetime.fromisoformat(vehicle_data['road_tax_expiry']),
-        insurance_expiry=datetime.fromisoformat(vehicle_data['insurance_expiry']),
-        puc_expiry=datetime.fromisoformat(vehicle_data['puc_expiry']),
-        fitness_expiry=datetime.fromisoformat(vehicle_data['fitness_expiry'])
+        **{key: datetime.fromisoformat(vehicle_data[key]) for key in vehicle_documents.EXPIRY_FIELDS}
     )
     
     vehicle_dict = vehicle.model_dump()
-    for key in ['created_at', 'updated_at', 'road_tax_expiry', 'insurance_expiry', 'puc_expiry', 'fitness_expiry']:
+    for key in VEHICLE_DATE_FIELDS:
         if vehicle_dict[key]:
             vehicle_dict[key] = vehicle_dict[key].isoformat()
-    
-    await db.vehicles.insert_one(vehicle_dict)
+    vehicle_dict['normalized_registration'] = registration.normalize_registration(vehicle.registration_number)
+    return vehicle, vehicle_documents.to_storage(vehicle_dict, layout)
+
+_json_datetime = TypeAdapter(datetime)
+
+def sparse_vehicle(vehicle: dict, selected: List[str]) -> dict:
+    """A projected vehicle in the JSON form ``Vehicle`` serializes to, with
+    dates rendered by Pydantic rather than left as stored."""
+    vehicle_documents.flatten(vehicle, selected)
+    for key in VEHICLE_DATE_FIELDS:
+        if vehicle.get(key):
+            vehicle[key] = _json_datetime.dump_python(_json_datetime.validate_python(vehicle[key]), mode="json")
     return vehicle
 
-@api_router.post("/vehicles/bulk", response_model=List[Vehicle])
+def vehicle_from_document(vehicle: dict) -> Vehicle:
+    vehicle_documents.flatten(vehicle)
+    for key in VEHICLE_DATE_FIELDS:
+        if vehicle.get(key) and isinstance(vehicle[key], str):
+            vehicle[key] = datetime.fromisoformat(vehicle[key])
+    return Vehicle(**vehicle)
+
+async def refresh_vehicle_document(runtime: Runtime, vehicle: dict, session=None) -> dict:
+    db = runtime.db
+    vehicle_data = await runtime.registry_client.lookup(vehicle['registration_number'])
+    
+    update = vehicle_documents.storage_update({
+        **{key: vehicle_data[key] for key in vehicle_documents.EXPIRY_FIELDS},
+        'updated_at': datetime.now(timezone.utc).isoformat()
+    }, runtime.config.vehicle_layout)
+    
+    revision = await fleet_summary.summary_revision(db, vehicle['user_id'])
+    updated_vehicle = await db.vehicles.find_one_and_update(
+        {"id": vehicle['id'], "user_id": vehicle['user_id']},
+        update,
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    clock = fleet_summary.summary_clock()
+    await fleet_summary.apply_delta(db, vehicle['user_id'], fleet_summary.merge_deltas(
+        fleet_summary.vehicle_delta(vehicle, clock, sign=-1),
+        fleet_summary.vehicle_delta(update["$set"], clock)
+    ), revision)
+    return updated_vehicle
+
+def registration_filter(user_id: str, normalized) -> dict:
+    if isinstance(normalized, list):
+        normalized = {"$in": normalized}
+    return {"user_id": user_id, "normalized_registration": normalized}
+
+def conflict_exception(registration_numbers: List[str]) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Vehicle already exists: {', '.join(registration_numbers)}"
+    )
+
+@api_router.post("/vehicles", response_model=Vehicle, dependencies=[admit("create")])
+async def add_vehicle(
+    vehicle_create: VehicleCreate,
+    current_user: User = Depends(get_current_user),
+    runtime: Runtime = Depends(get_runtime)
+):
+    db = runtime.db
+    normalized = registration.normalize_registration(vehicle_create.registration_number)
+    if not normalized:
+        raise HTTPException(status_code=400, detail="Invalid registration number")
+    
+    existing = await db.vehicles.find_one(registration_filter(current_user.id, normalized), {"_id": 0})
+    if not existing:
+        vehicle_data = await runtime.registry_client.lookup(vehicle_create.registration_number)
+        vehicle, vehicle_dict = build_vehicle(current_user.id, vehicle_data, runtime.config.vehicle_layout)
+        
+        revision = await fleet_summary.summary_revision(db, current_user.id)
+        try:
+            result = await db.vehicles.update_one(
+                registration_filter(current_user.id, normalized),
+                {"$setOnInsert": vehicle_dict},
+                upsert=True
+            )
+            inserted = result.upserted_id is not None
+        except DuplicateKeyError:
+            inserted = False
+        
+        if inserted:
+            await fleet_summary.apply_delta(db, current_user.id, fleet_summary.vehicle_delta(vehicle_dict, fleet_summary.summary_clock()), revision)
+            await bump_data_version(runtime.db, current_user.id)
+            return vehicle
+        existing = await db.vehicles.find_one(registration_filter(current_user.id, normalized), {"_id": 0})
+    
+    if vehicle_create.on_conflict == "error":
+        raise conflict_exception([existing['registration_number']])
+    if vehicle_create.on_conflict == "refresh":
+        existing = await refresh_vehicle_document(runtime, existing)
+        await bump_data_version(runtime.db, current_user.id)
+    return vehicle_from_document(existing)
+
+@api_router.post("/vehicles/bulk", response_model=List[Vehicle], dependencies=[admit("bulk")])
 async def add_vehicles_bulk(
     bulk_create: VehicleBulkCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    runtime: Runtime = Depends(get_runtime)
 ):
-    vehicles = []
+    db = runtime.db
+    requested = {}
     for reg_number in bulk_create.registration_numbers:
-        vehicle_data = await mock_vehicle_api(reg_number)
-        
-        vehicle = Vehicle(
-            user_id=current_user.id,
-            registration_number=vehicle_data['registration_number'],
-            vehicle_type=vehicle_data['vehicle_type'],
-            owner_name=vehicle_data['owner_name'],
-            manufacturer=vehicle_data['manufacturer'],
-            model=vehicle_data['model'],
-            year=vehicle_data['year'],
-            road_tax_expiry=datetime.fromisoformat(vehicle_data['road_tax_expiry']),
-            insurance_expiry=datetime.fromisoformat(vehicle_data['insurance_expiry']),
-            puc_expiry=datetime.fromisoformat(vehicle_data['puc_expiry']),
-            fitness_expiry=datetime.fromisoformat(vehicle_data['fitness_expiry'])
-        )
-        
-        vehicle_dict = vehicle.model_dump()
-        for key in ['created_at', 'updated_at', 'road_tax_expiry', 'insurance_expiry', 'puc_expiry', 'fitness_expiry']:
-            if vehicle_dict[key]:
-                vehicle_dict[key] = vehicle_dict[key].isoformat()
+        normalized = registration.normalize_registration(reg_number)
+        if normalized:
+            requested.setdefault(normalized, reg_number)
+    
+    existing = {
+        v['normalized_registration']: v
+        for v in await db.vehicles.find(registration_filter(current_user.id, list(requested)), {"_id": 0}).to_list(None)
+    }
+    if existing and bulk_create.on_conflict == "error":
+        raise conflict_exception([v['registration_number'] for v in existing.values()])
+    
+    new_documents = {}
+    for normalized, reg_number in requested.items():
+        if normalized not in existing:
+            vehicle_data = await runtime.registry_client.lookup(reg_number)
+            new_documents[normalized] = build_vehicle(current_user.id, vehicle_data, runtime.config.vehicle_layout)[1]
+    
+    changed = False
+    if new_documents:
+        order = list(new_documents)
+        revision = await fleet_summary.summary_revision(db, current_user.id)
+        try:
+            result = await db.vehicles.bulk_write([
+                UpdateOne(registration_filter(current_user.id, normalized), {"$setOnInsert": vehicle_dict}, upsert=True)
+                for normalized, vehicle_dict in new_documents.items()
+            ], ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # A concurrent insert of the same registration fails our upsert
+            # with E11000; those fall through to the lost_races re-read below.
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+            upserted = {u['index']: u['_id'] for u in e.details.get('upserted', [])}
+        inserted = {order[index] for index in upserted}
+        clock = fleet_summary.summary_clock()
+        await fleet_summary.apply_delta(db, current_user.id, fleet_summary.merge_deltas(
+            *(fleet_summary.vehicle_delta(new_documents[n], clock) for n in inserted)
+        ), revision)
+        changed = bool(inserted)
         
-        await db.vehicles.insert_one(vehicle_dict)
-        vehicles.append(vehicle)
+        lost_races = [n for n in new_documents if n not in inserted]
+        if lost_races:
+            for v in await db.vehicles.find(registration_filter(current_user.id, lost_races), {"_id": 0}).to_list(None):
+                existing[v['normalized_registration']] = v
+            for n in lost_races:
+                del new_documents[n]
     
+    if bulk_create.on_conflict == "refresh":
+        for normalized, vehicle in existing.items():
+            existing[normalized] = await refresh_vehicle_document(runtime, vehicle)
+            changed = True
+    
+    if changed:
+        await bump_data_version(runtime.db, current_user.id)
+    
+    vehicles = []
+    for normalized in requested:
+        if normalized in new_documents:
+            vehicles.append(vehicle_from_document(dict(new_documents[normalized])))
+        elif normalized in existing:
+            vehicles.append(vehicle_from_document(existing[normalized]))
     return vehicles
 
 @api_router.get("/vehicles", response_model=List[Vehicle])
 async def get_vehicles(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    fields: Optional[str] = None,
+    session=read_session("lists"),
+    runtime: Runtime = Depends(get_runtime)
 ):
+    selected = parse_vehicle_fields(fields)
+    not_modified = await conditional_get(request, response, current_user.id, session=session)
+    if not_modified:
+        return not_modified
+    
     query = {"user_id": current_user.id}
     if search:
         query["registration_number"] = {"$regex": search, "$options": "i"}
     
-    vehicles = await db.vehicles.find(query, {"_id": 0}).to_list(1000)
-    
-    for vehicle in vehicles:
-        for key in ['created_at', 'updated_at', 'road_tax_expiry', 'insurance_expiry', 'puc_expiry', 'fitness_expiry']:
-            if vehicle.get(key) and isinstance(vehicle[key], str):
-                vehicle[key] = datetime.fromisoformat(vehicle[key])
+    vehicles = await runtime.read_router.database("lists").vehicles.find(query, vehicle_projection(selected), session=session).to_list(1000)
+    if selected:
+        return sparse_response(response, [sparse_vehicle(v, selected) for v in vehicles])
     
-    return [Vehicle(**v) for v in vehicles]
+    return [vehicle_from_document(v) for v in vehicles]
 
-@api_router.put("/vehicles/{vehicle_id}/refresh", response_model=Vehicle)
+@api_router.put("/vehicles/{vehicle_id}/refresh", response_model=Vehicle, dependencies=[admit("refresh")])
 async def refresh_vehicle(
     vehicle_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    session=read_session("primary"),
+    runtime: Runtime = Depends(get_runtime)
 ):
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "user_id": current_user.id}, {"_id": 0})
+    vehicle = await runtime.db.vehicles.find_one({"id": vehicle_id, "user_id": current_user.id}, {"_id": 0}, session=session)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
     
-    vehicle_data = await mock_vehicle_api(vehicle['registration_number'])
-    
-    update_data = {
-        'road_tax_expiry': vehicle_data['road_tax_expiry'],
-        'insurance_expiry': vehicle_data['insurance_expiry'],
-        'puc_expiry': vehicle_data['puc_expiry'],
-        'fitness_expiry': vehicle_data['fitness_expiry'],
-        'updated_at': datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.vehicles.update_one(
-        {"id": vehicle_id, "user_id": current_user.id},
-        {"$set": update_data}
-    )
-    
-    updated_vehicle = await db.vehicles.find_one({"id": vehicle_id}, {"_id": 0})
-    for key in ['created_at', 'updated_at', 'road_tax_expiry', 'insurance_expiry', 'puc_expiry', 'fitness_expiry']:
-        if updated_vehicle.get(key) and isinstance(updated_vehicle[key], str):
-            updated_vehicle[key] = datetime.fromisoformat(updated_vehicle[key])
-    
-    return Vehicle(**updated_vehicle)
+    updated_vehicle = await refresh_vehicle_document(runtime, vehicle, session=session)
+    await bump_data_version(runtime.db, current_user.id)
+    return vehicle_from_document(updated_vehicle)
 
 @api_router.get("/vehicles/{vehicle_id}", response_model=Vehicle)
 async def get_vehicle(
     vehicle_id: str,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    fields: Optional[str] = None,
+    session=read_session("lists"),
+    runtime: Runtime = Depends(get_runtime)
 ):
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "user_id": current_user.id}, {"_id": 0})
+    selected = parse_vehicle_fields(fields)
+    not_modified = await conditional_get(request, response, current_user.id, session=session)
+    if not_modified:
+        return not_modified
+    
+    vehicle = await runtime.read_router.database("lists").vehicles.find_one(
+        {"id": vehicle_id, "user_id": current_user.id}, vehicle_projection(selected), session=session
+    )
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
+    if selected:
+        return sparse_response(response, sparse_vehicle(vehicle, selected))
     
-    for key in ['created_at', 'updated_at', 'road_tax_expiry', 'insurance_expiry', 'puc_expiry', 'fitness_expiry']:
-        if vehicle.get(key) and isinstance(vehicle[key], str):
-            vehicle[key] = datetime.fromisoformat(vehicle[key])
-    
-    return Vehicle(**vehicle)
+    return vehicle_from_document(vehicle)
 
 @api_router.delete("/vehicles/{vehicle_id}")
 async def delete_vehicle(
     vehicle_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    runtime: Runtime = Depends(get_runtime)
 ):
-    result = await db.vehicles.delete_one({"id": vehicle_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    db = runtime.db
+    revision = await fleet_summary.summary_revision(db, current_user.id)
+    deleted = await db.vehicles.find_one_and_delete({"id": vehicle_id, "user_id": current_user.id}, {"_id": 0})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Vehicle not found")
+    await fleet_summary.apply_delta(db, current_user.id, fleet_summary.vehicle_delta(deleted, fleet_summary.summary_clock(), sign=-1), revision)
+    await bump_data_version(runtime.db, current_user.id)
     return {"message": "Vehicle deleted successfully"}
 
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    vehicles = await db.vehicles.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    
-    total_vehicles = len(vehicles)
-    expiring_this_month = 0
-    overdue = {"road_tax": 0, "insurance": 0, "puc": 0}
-    
-    now = datetime.now(timezone.utc)
-    month_end = now + timedelta(days=30)
+async def get_dashboard_stats(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    session=read_session("dashboard"),
+    runtime: Runtime = Depends(get_runtime)
+):
+    not_modified = await conditional_get(request, response, current_user.id, fleet_summary.summary_clock().isoformat(), session=session)
+    if not_modified:
+        return not_modified
     
-    for vehicle in vehicles:
-        for key in ['road_tax_expiry', 'insurance_expiry', 'puc_expiry']:
-            if vehicle.get(key):
-                expiry_date = datetime.fromisoformat(vehicle[key]) if isinstance(vehicle[key], str) else vehicle[key]
-                if expiry_date.tzinfo is None:
-                    expiry_date = expiry_date.replace(tzinfo=timezone.utc)
-                
-                if expiry_date < now:
-                    doc_type = key.replace('_expiry', '')
-                    overdue[doc_type] = overdue.get(doc_type, 0) + 1
-                elif expiry_date <= month_end:
-                    expiring_this_month += 1
-    
-    return {
-        "total_vehicles": total_vehicles,
-        "expiring_this_month": expiring_this_month,
-        "overdue": overdue
-    }
+    summary = await fleet_summary.get_user_summary(
+        runtime.db, current_user.id, read_db=runtime.read_router.database("dashboard"), session=session
+    )
+    return fleet_summary.dashboard_view(summary)
 
 @api_router.get("/settings", response_model=UserSettings)
-async def get_settings(current_user: User = Depends(get_current_user)):
-    settings = await db.settings.find_one({"user_id": current_user.id}, {"_id": 0})
-    
-    if not settings:
-        default_settings = UserSettings(user_id=current_user.id)
-        settings_dict = default_settings.model_dump()
-        settings_dict['updated_at'] = settings_dict['updated_at'].isoformat()
-        await db.settings.insert_one(settings_dict)
-        return default_settings
-    
-    if isinstance(settings.get('updated_at'), str):
-        settings['updated_at'] = datetime.fromisoformat(settings['updated_at'])
+async def get_settings(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    runtime: Runtime = Depends(get_runtime)
+):
+    not_modified = await conditional_get(request, response, current_user.id)
+    if not_modified:
+        return not_modified
     
-    return UserSettings(**settings)
+    def load():
+        return runtime.settings_store.get(current_user.id, version=request.state.data_version)
+
+    context = batch_context.get()
+    return await (context.shared("settings", load) if context else load())
 
 @api_router.patch("/settings")
 async def update_settings(
     settings_update: UserSettingsUpdate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    runtime: Runtime = Depends(get_runtime)
 ):
     update_data = {k: v for k, v in settings_update.model_dump().items() if v is not None}
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
-    existing_settings = await db.settings.find_one({"user_id": current_user.id})
-    
-    if not existing_settings:
-        default_settings = UserSettings(user_id=current_user.id)
-        settings_dict = default_settings.model_dump()
-        settings_dict.update(update_data)
-        settings_dict['updated_at'] = settings_dict['updated_at'] if isinstance(settings_dict['updated_at'], str) else settings_dict['updated_at'].isoformat()
-        await db.settings.insert_one(settings_dict)
-    else:
-        await db.settings.update_one(
-            {"user_id": current_user.id},
-            {"$set": update_data}
-        )
-    
+    await runtime.settings_store.update(current_user.id, update_data)
+    await bump_data_version(runtime.db, current_user.id)
     return {"message": "Settings updated successfully"}
 
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: User = Depends(get_current_user)):
-    notifications = await db.notifications.find(
+async def get_notifications(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    session=read_session("lists"),
+    runtime: Runtime = Depends(get_runtime)
+):
+    read_db = runtime.read_router.database("lists")
+    oldest_read_at = await notification_retention.oldest_read_at(read_db, current_user.id, session=session)
+    not_modified = await conditional_get(request, response, current_user.id, oldest_read_at, session=session)
+    if not_modified:
+        return not_modified
+    
+    notifications = await read_db.notifications.find(
         {"user_id": current_user.id},
-        {"_id": 0}
+        {"_id": 0},
+        session=session
     ).sort("created_at", -1).to_list(100)
     
     for notif in notifications:
@@ -482,97 +819,288 @@ async def get_notifications(current_user: User = Depends(get_current_user)):
     
     return [Notification(**n) for n in notifications]
 
+@api_router.get("/notifications/archive")
+async def get_notification_archive(
+    request: Request,
+    response: Response,
+    before: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    limit: int = Query(3, ge=1, le=12),
+    current_user: User = Depends(get_current_user),
+    session=read_session("lists"),
+    runtime: Runtime = Depends(get_runtime)
+):
+    not_modified = await conditional_get(request, response, current_user.id, session=session)
+    if not_modified:
+        return not_modified
+    
+    return await notification_retention.get_archive(
+        runtime.read_router.database("lists"), current_user.id, before, limit, session=session
+    )
+
 @api_router.patch("/notifications/{notification_id}/read")
 async def mark_notification_read(
     notification_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    runtime: Runtime = Depends(get_runtime)
 ):
-    result = await db.notifications.update_one(
+    result = await runtime.db.notifications.update_one(
         {"id": notification_id, "user_id": current_user.id},
-        {"$set": {"is_read": True}}
+        {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc)}}
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Notification not found")
+    await bump_data_version(runtime.db, current_user.id)
     return {"message": "Notification marked as read"}
 
-async def check_expiries_and_notify():
+@api_router.post("/batch")
+async def batch_get(
+    batch_request: BatchRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    runtime: Runtime = Depends(get_runtime)
+):
+    limit = request.app.state.config.batch_max_size
+    if len(batch_request.requests) > limit:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {limit} requests per batch"
+        )
+    
+    async with runtime.read_router.session("primary") as session:
+        version = await get_data_version(runtime.db, current_user.id, session=session)
+        context = BatchContext(current_user, version, session)
+    items = [item.model_dump() for item in batch_request.requests]
+    return {"responses": await run_batch(request.app, request, context, items)}
+
+async def check_expiries_and_notify(runtime: Runtime):
     logger.info("Running scheduled expiry check...")
     
     try:
-        all_vehicles = await db.vehicles.find({}, {"_id": 0}).to_list(10000)
-        now = datetime.now(timezone.utc)
-        remind_window = now + timedelta(days=15)
+        async with runtime.read_router.session("scan") as session:
+            await scan_expiries(runtime, runtime.read_router.database("scan"), session)
+        logger.info("Expiry check completed")
+    except Exception as e:
+        logger.error(f"Error in expiry check: {str(e)}")
+
+async def scan_expiries(runtime: Runtime, scan_db, session, now: Optional[datetime] = None, notify=None) -> int:
+    """Create due expiry notifications and email them through ``notify``
+    (``send_email_notification`` by default). ``now`` overrides the clock for
+    simulations. Returns the number of notifications created.
+
+    Only vehicles with a reminder due within the longest window any user
+    has configured are loaded, through the expiry indexes."""
+    now = now or datetime.now(timezone.utc)
+    longest = await scan_db.settings.find_one(
+        {}, {"_id": 0, "notification_days_before": 1}, sort=[("notification_days_before", -1)], session=session
+    )
+    max_days = max(UserSettings.model_fields['notification_days_before'].default,
+                   (longest or {}).get('notification_days_before') or 0)
+    layout = vehicle_documents.query_layout(runtime.config.vehicle_layout)
+    candidates = vehicle_documents.expiry_filter(
+        vehicle_documents.REMINDER_TYPES, layout, gt=now, lte=now + timedelta(days=max_days)
+    )
+    all_vehicles = await scan_db.vehicles.find(candidates, {"_id": 0}, session=session).to_list(None)
+    notify = notify or send_email_notification
+    created = 0
+    
+    user_ids = list({vehicle['user_id'] for vehicle in all_vehicles})
+    users = {
+        u['id']: u
+        for u in await scan_db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "email": 1}, session=session).to_list(None)
+    }
+    user_settings = await runtime.settings_store.get_many(user_ids, session=session)
+    
+    for vehicle in all_vehicles:
+        user = users.get(vehicle['user_id'])
+        if not user:
+            continue
+        settings = user_settings[vehicle['user_id']]
+        remind_window = now + timedelta(days=settings.notification_days_before)
         
-        for vehicle in all_vehicles:
-            user = await db.users.find_one({"id": vehicle['user_id']}, {"_id": 0})
-            if not user:
-                continue
-            
-            for doc_type in ['road_tax', 'insurance', 'puc']:
-                expiry_key = f"{doc_type}_expiry"
-                if vehicle.get(expiry_key):
-                    expiry_date = datetime.fromisoformat(vehicle[expiry_key]) if isinstance(vehicle[expiry_key], str) else vehicle[expiry_key]
-                    if expiry_date.tzinfo is None:
-                        expiry_date = expiry_date.replace(tzinfo=timezone.utc)
+        expiries = vehicle_documents.expiries(vehicle)
+        for doc_type in vehicle_documents.REMINDER_TYPES:
+            expiry = expiries[doc_type]
+            if expiry:
+                expiry_date = datetime.fromisoformat(expiry) if isinstance(expiry, str) else expiry
+                if expiry_date.tzinfo is None:
+                    expiry_date = expiry_date.replace(tzinfo=timezone.utc)
+                
+                if now < expiry_date <= remind_window:
+                    days_left = (expiry_date - now).days
                     
-                    if now < expiry_date <= remind_window:
-                        days_left = (expiry_date - now).days
-                        
-                        existing_notif = await db.notifications.find_one({
+                    with primary_reads():
+                        existing_notif = await runtime.db.notifications.find_one({
                             "user_id": vehicle['user_id'],
                             "vehicle_id": vehicle['id'],
                             "notification_type": doc_type,
                             "created_at": {"$gte": (now - timedelta(days=7)).isoformat()}
-                        })
+                        }, session=session)
+                    
+                    if not existing_notif:
+                        notification = Notification(
+                            user_id=vehicle['user_id'],
+                            vehicle_id=vehicle['id'],
+                            title=f"{doc_type.replace('_', ' ').title()} Expiring Soon",
+                            message=f"Vehicle {vehicle['registration_number']} {doc_type.replace('_', ' ')} expires in {days_left} days",
+                            notification_type=doc_type,
+                            created_at=now
+                        )
                         
-                        if not existing_notif:
-                            notification = Notification(
-                                user_id=vehicle['user_id'],
-                                vehicle_id=vehicle['id'],
-                                title=f"{doc_type.replace('_', ' ').title()} Expiring Soon",
-                                message=f"Vehicle {vehicle['registration_number']} {doc_type.replace('_', ' ')} expires in {days_left} days",
-                                notification_type=doc_type
-                            )
-                            
-                            notif_dict = notification.model_dump()
-                            notif_dict['created_at'] = notif_dict['created_at'].isoformat()
-                            await db.notifications.insert_one(notif_dict)
-                            
-                            await send_email_notification(
+                        notif_dict = notification.model_dump()
+                        notif_dict['created_at'] = notif_dict['created_at'].isoformat()
+                        await runtime.db.notifications.insert_one(notif_dict, session=session)
+                        await bump_data_version(runtime.db, vehicle['user_id'])
+                        created += 1
+                        
+                        if settings.email_notifications:
+                            await notify(
                                 user['email'],
                                 notification.title,
                                 notification.message
                             )
-        
-        logger.info("Expiry check completed")
+    return created
+
+def require_admin(request: Request):
+    token = request.app.state.config.profiler_token
+    supplied = request.headers.get("x-profile-token", "")
+    if not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+@api_router.get("/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles(request: Request, limit: int = Query(50, ge=1, le=200)):
+    return await asyncio.to_thread(request.app.state.profile_store.list, limit)
+
+@api_router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, request: Request):
+    path = request.app.state.profile_store.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=path.name)
+
+@api_router.get("/admission/stats", dependencies=[Depends(require_admin)])
+async def get_admission_stats(request: Request):
+    controller = request.app.state.admission
+    return controller.stats() if controller else {}
+
+@api_router.get("/read-routing/stats", dependencies=[Depends(require_admin)])
+async def get_read_routing_stats(runtime: Runtime = Depends(get_runtime)):
+    return runtime.read_node_listener.stats()
+
+async def archive_notifications(runtime: Runtime):
+    try:
+        for user_id in await notification_retention.archive_stale(
+            runtime.db, archive_after_days=runtime.config.notification_archive_days
+        ):
+            await bump_data_version(runtime.db, user_id)
     except Exception as e:
-        logger.error(f"Error in expiry check: {str(e)}")
+        logger.error(f"Error archiving notifications: {str(e)}")
+
+def create_scheduler(state):
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    
+    expiry_job = check_expiries_and_notify
+    if state.config.profile_jobs:
+        expiry_job = profiled_job(expiry_job, "job check_expiries_and_notify",
+                                  state.profile_store, state.config.profile_interval_ms / 1000)
+    
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(expiry_job, 'interval', hours=24, args=[state.runtime])
+    # Summaries go stale at midnight UTC; until the roll has moved them,
+    # every dashboard read and vehicle write rebuilds the user's summary.
+    scheduler.add_job(fleet_summary.roll_forward, 'cron', hour=0, minute=0, args=[state.runtime.db],
+                      kwargs={"layout": state.config.vehicle_layout}, timezone=timezone.utc)
+    scheduler.add_job(archive_notifications, 'cron', hour=1, minute=0, args=[state.runtime], timezone=timezone.utc)
+    return scheduler
+
+async def ensure_indexes(runtime: Runtime):
+    db = runtime.db
+    try:
+        await registration.ensure_registration_index(db)
+        await notification_retention.ensure_indexes(db, read_ttl_days=runtime.config.notification_read_ttl_days)
+        await db.settings.create_index("user_id", unique=True)
+        await db.settings.create_index("notification_days_before")
+        await vehicle_documents.ensure_indexes(db, runtime.config.vehicle_layout)
+    except Exception as e:
+        logger.error(f"Error ensuring indexes: {str(e)}")
 
-scheduler = AsyncIOScheduler()
-scheduler.add_job(check_expiries_and_notify, 'interval', hours=24)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config: AppConfig = app.state.config
+    runtime = app.state.runtime = Runtime.open(config)
+    index_task = asyncio.create_task(ensure_indexes(runtime))
+    
+    scheduler = None
+    if config.enable_scheduler:
+        scheduler = create_scheduler(app.state)
+        scheduler.start()
+        logger.info("Scheduler started")
+    
+    try:
+        yield
+    finally:
+        if scheduler:
+            scheduler.shutdown()
+        index_task.cancel()
+        await runtime.close()
+        app.state.runtime = None
+        logger.info("Application shutdown")
 
-@app.on_event("startup")
-async def startup_event():
-    scheduler.start()
-    logger.info("Scheduler started")
+async def registry_not_found_handler(request: Request, exc: RegistryNotFound):
+    return JSONResponse(status_code=404, content={"detail": f"Vehicle {exc} not found in registry"})
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    scheduler.shutdown()
-    client.close()
-    logger.info("Application shutdown")
+async def registry_error_handler(request: Request, exc: RegistryError):
+    logger.error(f"Vehicle registry error: {exc}")
+    return JSONResponse(status_code=502, content={"detail": "Vehicle registry returned an invalid response"})
 
-app.include_router(api_router)
+async def registry_unavailable_handler(request: Request, exc: RegistryUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Vehicle registry is unavailable, try again later"},
+        headers={"Retry-After": str(int(exc.retry_after) or 1)}
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def create_app(config: Optional[AppConfig] = None) -> FastAPI:
+    app = FastAPI(title="FleetCare API", lifespan=lifespan)
+    app.state.config = config or AppConfig.from_env()
+    app.state.profile_store = ProfileStore(app.state.config.profile_dir)
+    app.state.runtime = None
+    app.state.admission = None
+    app.state.trusted_proxies = None
+    if app.state.config.trusted_proxies is not None:
+        app.state.trusted_proxies = parse_networks(app.state.config.trusted_proxies)
+    elif app.state.config.admission_enabled:
+        logger.warning("TRUSTED_PROXIES is not set: anonymous callers share the global admission buckets. "
+                       "Set it to the proxy networks, or to 'none' when clients connect directly.")
+    if app.state.config.admission_enabled:
+        store = MongoBucketStore(lambda: app.state.runtime.db.rate_limits) if app.state.config.admission_store == "mongo" else None
+        app.state.admission = AdmissionController(build_policies(app.state.config.admission_policies), store)
+    
+    app.add_exception_handler(RegistryNotFound, registry_not_found_handler)
+    app.add_exception_handler(RegistryUnavailable, registry_unavailable_handler)
+    app.add_exception_handler(RegistryError, registry_error_handler)
+    app.include_router(api_router)
+    
+    if app.state.config.profiler_token or app.state.config.profile_sample_rate:
+        app.add_middleware(
+            ProfilingMiddleware,
+            store=app.state.profile_store,
+            token=app.state.config.profiler_token,
+            sample_rate=app.state.config.profile_sample_rate,
+            interval=app.state.config.profile_interval_ms / 1000,
+        )
+    app.add_middleware(CompressionMiddleware, minimum_size=app.state.config.compression_min_size)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=app.state.config.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+
+app = create_app()
@@ -0,0 +1,85 @@
+"""Cached per-user settings.
+
+Reads never write: a user without a stored document gets synthesized
+defaults with ``updated_at`` unset, so they serialize identically under one
+ETag. Updates are a single upsert. Cache entries are tagged with the
+user's data version when the caller knows it, so a write on any worker
+(which bumps the version) invalidates the entry everywhere; otherwise they
+expire after ``ttl`` seconds.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+import time
+
+
+class SettingsStore:
+    def __init__(self, collection, model, ttl: float = 60.0, max_entries: int = 10000):
+        self.collection = collection
+        self.model = model
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache: Dict[str, tuple] = {}
+
+    def _parse(self, user_id: str, document: Optional[dict]):
+        if not document:
+            return self.model(user_id=user_id)
+        if isinstance(document.get('updated_at'), str):
+            document['updated_at'] = datetime.fromisoformat(document['updated_at'])
+        return self.model(**document)
+
+    def _remember(self, user_id: str, settings, version: Optional[int]):
+        if len(self._cache) >= self.max_entries:
+            self._cache.clear()
+        self._cache[user_id] = (time.monotonic() + self.ttl, version, settings)
+
+    def _cached(self, user_id: str, version: Optional[int]):
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return None
+        expires, cached_version, settings = entry
+        if time.monotonic() >= expires or (version is not None and cached_version != version):
+            return None
+        return settings
+
+    def invalidate(self, user_id: str):
+        self._cache.pop(user_id, None)
+
+    async def get(self, user_id: str, version: Optional[int] = None, session=None):
+        settings = self._cached(user_id, version)
+        if settings is None:
+            document = await self.collection.find_one({"user_id": user_id}, {"_id": 0}, session=session)
+            settings = self._parse(user_id, document)
+            self._remember(user_id, settings, version)
+        return settings
+
+    async def get_many(self, user_ids: Iterable[str], session=None) -> dict:
+        """Settings for every user in ``user_ids`` with at most one query."""
+        result = {}
+        missing = []
+        for user_id in set(user_ids):
+            settings = self._cached(user_id, None)
+            if settings is None:
+                missing.append(user_id)
+            else:
+                result[user_id] = settings
+        if missing:
+            found = {
+                d['user_id']: d
+                async for d in self.collection.find({"user_id": {"$in": missing}}, {"_id": 0}, session=session)
+            }
+            for user_id in missing:
+                result[user_id] = self._parse(user_id, found.get(user_id))
+                self._remember(user_id, result[user_id], None)
+        return result
+
+    async def update(self, user_id: str, update_data: dict):
+        defaults = self.model(user_id=user_id).model_dump()
+        await self.collection.update_one(
+            {"user_id": user_id},
+            {
+                "$set": update_data,
+                "$setOnInsert": {k: v for k, v in defaults.items() if k not in update_data and k != 'user_id'},
+            },
+            upsert=True
+        )
+        self.invalidate(user_id)
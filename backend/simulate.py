@@ -0,0 +1,180 @@
+"""Capacity-planning simulation for the expiry scan.
+
+Seeds a local database with a synthetic fleet, then runs the real
+``scan_expiries`` once per simulated day with the clock advanced a day at a
+time. Emails go to a null sink. Each day reports the MongoDB commands issued,
+notifications created, emails queued and wall time.
+
+    python simulate.py [--users 100] [--vehicles-per-user 20] [--days 30]
+                       [--start 2025-01-01] [--db-name fleetcare_sim] [--json]
+                       [--layout fields|dual|documents]
+
+Runs against ``MONGO_URL`` (default ``mongodb://localhost:27017``) and drops
+``--db-name`` before seeding, so never point it at a real database.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from pymongo import monitoring
+
+import vehicle_documents
+
+ROOT_DIR = Path(__file__).parent
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.counts = Counter()
+
+    def started(self, event):
+        self.counts[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self) -> Counter:
+        counts, self.counts = self.counts, Counter()
+        return counts
+
+
+class NullEmailSink:
+    def __init__(self):
+        self.queued = 0
+
+    async def __call__(self, to_email: str, subject: str, message: str):
+        self.queued += 1
+
+    def take(self) -> int:
+        queued, self.queued = self.queued, 0
+        return queued
+
+
+async def seed(db, users: int, vehicles_per_user: int, start: datetime, rng: random.Random, layout: str = 'fields'):
+    """Users with varied settings and vehicles whose expiries are spread over
+    the year after ``start``, so every simulated day has some due."""
+    now = start.isoformat()
+    user_docs, settings_docs, vehicle_docs = [], [], []
+    for u in range(users):
+        user_id = f"sim-user-{u}"
+        user_docs.append({"id": user_id, "email": f"{user_id}@example.com", "name": user_id,
+                          "password_hash": "", "created_at": now})
+        settings_docs.append({
+            "user_id": user_id,
+            "email_notifications": rng.random() < 0.8,
+            "push_notifications": False,
+            "notification_days_before": rng.choice([7, 15, 30]),
+            "notification_time": "09:00",
+            "updated_at": now,
+        })
+        for v in range(vehicles_per_user):
+            vehicle = {
+                "id": f"{user_id}-vehicle-{v}",
+                "user_id": user_id,
+                "registration_number": f"SIM{u:05d}{v:04d}",
+                "normalized_registration": f"SIM{u:05d}{v:04d}",
+                "vehicle_type": "Truck", "owner_name": "", "manufacturer": "", "model": "", "year": 2020,
+                "created_at": now, "updated_at": now,
+            }
+            for doc_type in vehicle_documents.DOCUMENT_TYPES:
+                vehicle[f"{doc_type}_expiry"] = (start + timedelta(days=rng.randint(-30, 365))).isoformat()
+            vehicle_docs.append(vehicle_documents.to_storage(vehicle, layout, start))
+    await db.users.insert_many(user_docs)
+    await db.settings.insert_many(settings_docs)
+    if vehicle_docs:
+        await db.vehicles.insert_many(vehicle_docs)
+    return len(vehicle_docs)
+
+
+async def simulate(db, days: int, start: datetime, counter: CommandCounter, layout: str = 'fields'):
+    import server
+    from settings_store import SettingsStore
+
+    config = server.AppConfig(mongo_url="", db_name=db.name, vehicle_layout=layout)
+    runtime = server.Runtime(config=config, db=db, settings_store=SettingsStore(db.settings, server.UserSettings))
+    sink = NullEmailSink()
+    counter.take()
+    for day in range(days):
+        clock = start + timedelta(days=day)
+        started = time.perf_counter()
+        created = await server.scan_expiries(runtime, db, None, now=clock, notify=sink)
+        wall = time.perf_counter() - started
+        ops = counter.take()
+        yield {
+            "day": clock.date().isoformat(),
+            "db_ops": sum(ops.values()),
+            "ops_by_command": dict(ops),
+            "notifications": created,
+            "emails": sink.take(),
+            "wall_seconds": round(wall, 3),
+        }
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Simulate the expiry scan over a horizon of days")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--vehicles-per-user", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--start", default=None, help="first simulated day (YYYY-MM-DD, default today)")
+    parser.add_argument("--db-name", default="fleetcare_sim")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per day")
+    parser.add_argument("--layout", choices=vehicle_documents.LAYOUTS, default=None,
+                        help="vehicle layout to seed and scan (default VEHICLE_LAYOUT or fields)")
+    args = parser.parse_args(argv)
+
+    load_dotenv(ROOT_DIR / '.env')
+    layout = args.layout or os.environ.get('VEHICLE_LAYOUT', 'fields')
+    if args.db_name == os.environ.get('DB_NAME'):
+        parser.error("--db-name must not be the application database; it is dropped before seeding")
+    start = datetime.fromisoformat(args.start) if args.start else datetime.now(timezone.utc)
+    start = start.replace(hour=9, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'), event_listeners=[counter])
+    db = client[args.db_name]
+
+    async def run():
+        await client.drop_database(args.db_name)
+        vehicles = await seed(db, args.users, args.vehicles_per_user, start, random.Random(args.seed), layout)
+        await db.settings.create_index("user_id", unique=True)
+        await db.settings.create_index("notification_days_before")
+        await vehicle_documents.ensure_indexes(db, layout)
+        await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+        print(f"Seeded {args.users} users, {vehicles} vehicles into {args.db_name}")
+
+        totals = Counter()
+        if not args.json:
+            print(f"{'day':<12}{'db ops':>8}{'notifs':>8}{'emails':>8}{'wall s':>9}")
+        async for report in simulate(db, args.days, start, counter, layout):
+            totals.update({k: report[k] for k in ("db_ops", "notifications", "emails", "wall_seconds")})
+            if args.json:
+                print(json.dumps(report))
+            else:
+                print(f"{report['day']:<12}{report['db_ops']:>8}{report['notifications']:>8}"
+                      f"{report['emails']:>8}{report['wall_seconds']:>9.3f}")
+        if not args.json:
+            print(f"{'total':<12}{totals['db_ops']:>8}{totals['notifications']:>8}"
+                  f"{totals['emails']:>8}{totals['wall_seconds']:>9.3f}")
+
+    try:
+        asyncio.run(run())
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
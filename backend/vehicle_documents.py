@@ -0,0 +1,283 @@
+"""Embedded compliance documents layout for vehicles.
+
+The original layout stores one top-level field per document type
+(``road_tax_expiry``, ``insurance_expiry``, ...). The compact layout keeps
+them in one array::
+
+    documents: [{"type": "road_tax", "expiry": "2025-03-01T00:00:00+00:00", "status": "active"}, ...]
+
+so a single multikey index on ``(documents.type, documents.expiry)`` serves
+every "what expires when" query, whatever the document type. Until the
+``documents`` layout is reached, queries also match the top-level fields, so
+each of those keeps a sparse index of its own. ``status`` is
+``active`` or ``expired`` as of the write that stored the entry; queries that
+need the current state go by ``expiry``.
+
+The layout (``AppConfig.vehicle_layout``, ``VEHICLE_LAYOUT``) selects what
+is written:
+
+* ``fields`` (default): top-level fields only, as before. Writes remove a
+  leftover ``documents`` array.
+* ``dual``: both layouts. Run ``migrate`` to backfill existing vehicles.
+* ``documents``: the array only. Switch once ``migrate`` has run in ``dual``;
+  ``migrate --drop-fields`` then removes the old fields. Writes remove
+  leftover top-level fields.
+
+Reads go through ``expiries``/``flatten``, which accept either layout, and
+``expiry_filter``/``expiring_pipeline`` build queries and aggregations over
+either. Every write leaves a vehicle in exactly the current layout, so each
+step of the migration can be rolled back by switching the layout back.
+
+Usage::
+
+    python vehicle_documents.py migrate [--drop-fields] [--dry-run]
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import os
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TYPES = ['road_tax', 'insurance', 'puc', 'fitness']
+REMINDER_TYPES = ['road_tax', 'insurance', 'puc']
+EXPIRY_FIELDS = [f"{doc_type}_expiry" for doc_type in DOCUMENT_TYPES]
+LAYOUTS = ('fields', 'dual', 'documents')
+INDEX_NAME = "documents_type_expiry"
+
+
+def _iso(value) -> Optional[str]:
+    if not value:
+        return None
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def to_documents(vehicle: dict, now: Optional[datetime] = None) -> List[dict]:
+    """Build the ``documents`` array from a vehicle's top-level expiry fields."""
+    now_iso = (now or datetime.now(timezone.utc)).isoformat()
+    documents = []
+    for doc_type in DOCUMENT_TYPES:
+        expiry = _iso(vehicle.get(f"{doc_type}_expiry"))
+        if expiry:
+            documents.append({
+                "type": doc_type,
+                "expiry": expiry,
+                "status": "active" if expiry >= now_iso else "expired",
+            })
+    return documents
+
+
+def expiries(vehicle: dict) -> Dict[str, Optional[str]]:
+    """Expiry per document type, from either layout. Array entries win."""
+    result = {doc_type: vehicle.get(f"{doc_type}_expiry") for doc_type in DOCUMENT_TYPES}
+    for document in vehicle.get('documents') or []:
+        result[document['type']] = document.get('expiry')
+    return result
+
+
+def flatten(vehicle: dict, fields: Optional[Iterable[str]] = None) -> dict:
+    """Rewrite ``vehicle`` in place to the top-level layout the API models use.
+    With ``fields``, only the expiry fields listed there are filled in."""
+    documents = vehicle.pop('documents', None)
+    if documents is not None:
+        wanted = set(fields) if fields is not None else set(EXPIRY_FIELDS)
+        for doc_type, expiry in expiries({**vehicle, 'documents': documents}).items():
+            if f"{doc_type}_expiry" in wanted:
+                vehicle[f"{doc_type}_expiry"] = expiry
+    return vehicle
+
+
+def to_storage(fields: dict, layout: str, now: Optional[datetime] = None) -> dict:
+    """Convert top-level expiry fields (ISO strings) into what ``layout``
+    stores. Non-expiry keys pass through unchanged."""
+    if layout == 'fields':
+        return fields
+    stored = {**fields, 'documents': to_documents(fields, now)}
+    if layout == 'documents':
+        for key in EXPIRY_FIELDS:
+            stored.pop(key, None)
+    return stored
+
+
+def storage_update(fields: dict, layout: str, now: Optional[datetime] = None) -> dict:
+    """Update document writing ``fields`` in ``layout`` and removing what
+    the other layout left behind, so a rolled-back vehicle has no stale copy."""
+    update = {"$set": to_storage(fields, layout, now)}
+    if layout == 'fields':
+        update["$unset"] = {"documents": ""}
+    elif layout == 'documents':
+        update["$unset"] = {key: "" for key in EXPIRY_FIELDS}
+    return update
+
+
+def projection(fields: Iterable[str]) -> dict:
+    """Projection for ``fields``; adds ``documents`` when an expiry is asked for."""
+    fields = list(fields)
+    result = {f: 1 for f in fields}
+    if any(f in EXPIRY_FIELDS for f in fields):
+        result['documents'] = 1
+    return result
+
+
+def _range(gte=None, gt=None, lte=None, lt=None) -> dict:
+    bounds = {"$gte": gte, "$gt": gt, "$lte": lte, "$lt": lt}
+    return {op: _iso(value) for op, value in bounds.items() if value is not None}
+
+
+def expiry_filter(doc_types, layout: str = 'dual', **bounds) -> dict:
+    """Filter for vehicles with an expiry of any of ``doc_types`` (a type or
+    a list) within ``bounds`` (``gte``/``gt``/``lte``/``lt``, datetimes or ISO
+    strings). In the documents layout this is a single ``$elemMatch`` the
+    multikey index serves; ``dual`` (the default) matches either layout."""
+    doc_types = [doc_types] if isinstance(doc_types, str) else list(doc_types)
+    expiry = _range(**bounds)
+    by_fields = [{f"{doc_type}_expiry": expiry} for doc_type in doc_types]
+    by_document = {"documents": {"$elemMatch": {
+        "type": doc_types[0] if len(doc_types) == 1 else {"$in": doc_types},
+        "expiry": expiry,
+    }}}
+    if layout == 'documents':
+        return by_document
+    if layout == 'fields':
+        return by_fields[0] if len(by_fields) == 1 else {"$or": by_fields}
+    return {"$or": [by_document, *by_fields]}
+
+
+def query_layout(layout: str) -> str:
+    """Layout to query in while ``layout`` is written. After a rollback to
+    ``fields``, vehicles not written since still only have the array, so
+    only the ``documents`` layout (reached through ``migrate``) narrows it."""
+    return 'documents' if layout == 'documents' else 'dual'
+
+
+def _merged_expiry(doc_type: str) -> dict:
+    """Aggregation expression for the ``doc_type`` expiry as ``expiries``
+    reads it: the array entry, else the top-level field, else null."""
+    entries = {"$filter": {"input": {"$ifNull": ["$documents", []]}, "as": "document",
+                           "cond": {"$eq": ["$$document.type", doc_type]}}}
+    from_array = {"$arrayElemAt": [{"$map": {"input": entries, "as": "document", "in": "$$document.expiry"}}, 0]}
+    return {"$ifNull": [from_array, {"$ifNull": [f"${doc_type}_expiry", None]}]}
+
+
+def expiring_pipeline(match: Optional[dict] = None, doc_types: Optional[List[str]] = None,
+                      group_by: Iterable[str] = ('type',), buckets: Sequence[Tuple[str, str, object]] = (),
+                      otherwise: str = 'other', missing: str = 'missing', layout: str = 'dual',
+                      **bounds) -> List[dict]:
+    """Aggregation counting expiries of ``doc_types`` in either layout, one
+    row per ``group_by`` key: ``{"_id": {...}, "count": n}``. Keys are
+    ``type``, ``bucket`` or vehicle fields such as ``user_id``.
+
+    ``buckets`` are ``(name, "$lt" | "$lte", bound)`` in ascending order; an
+    expiry goes to the first one it is below, else to ``otherwise``, or to
+    ``missing`` when unset. Expiries are compared as the UTC ISO strings they
+    are stored as. With ``bounds``, only expiries within them are counted and
+    the vehicles are matched through ``expiry_filter`` in ``layout``."""
+    doc_types = doc_types or DOCUMENT_TYPES
+    match = match or {}
+    if bounds:
+        window = expiry_filter(doc_types, layout, **bounds)
+        match = {"$and": [match, window]} if match else window
+    branches = [{"case": {"$in": ["$expiry.v", [None, ""]]}, "then": missing}]
+    branches += [{"case": {op: ["$expiry.v", _iso(bound)]}, "then": name} for name, op, bound in buckets]
+    keys = {
+        'type': "$expiry.k",
+        'bucket': {"$switch": {"branches": branches, "default": otherwise}},
+    }
+    pipeline = [
+        {"$match": match},
+        {"$project": {"_id": 0, **{key: 1 for key in group_by if key not in keys},
+                      "expiry": {doc_type: _merged_expiry(doc_type) for doc_type in doc_types}}},
+        {"$addFields": {"expiry": {"$objectToArray": "$expiry"}}},
+        {"$unwind": "$expiry"},
+    ]
+    if bounds:
+        pipeline.append({"$match": {"expiry.v": _range(**bounds)}})
+    pipeline.append({"$group": {
+        "_id": {key: keys.get(key, f"${key}") for key in group_by},
+        "count": {"$sum": 1},
+    }})
+    return pipeline
+
+
+async def ensure_indexes(db, layout: str = 'dual'):
+    """The multikey index and, unless only the ``documents`` layout is
+    queried, a sparse index per top-level expiry field, so each branch of
+    a ``dual`` filter is served by an index."""
+    await db.vehicles.create_index([("documents.type", 1), ("documents.expiry", 1)], name=INDEX_NAME)
+    if query_layout(layout) != 'documents':
+        for field in EXPIRY_FIELDS:
+            await db.vehicles.create_index(field, sparse=True)
+
+
+_UNMIGRATED = {"documents": {"$exists": False}}
+
+
+async def migrate(db, drop_fields: bool = False, dry_run: bool = False, batch_size: int = 1000) -> dict:
+    """Backfill ``documents`` on vehicles that lack it and, with
+    ``drop_fields``, remove the top-level expiry fields afterwards."""
+    now = datetime.now(timezone.utc)
+    backfilled = 0
+    ops = []
+    source = {"_id": 0, "id": 1, **{f: 1 for f in EXPIRY_FIELDS}}
+    async for vehicle in db.vehicles.find(_UNMIGRATED, source):
+        backfilled += 1
+        if dry_run:
+            continue
+        ops.append(UpdateOne({"id": vehicle['id'], "documents": {"$exists": False}},
+                             {"$set": {"documents": to_documents(vehicle, now)}}))
+        if len(ops) >= batch_size:
+            await db.vehicles.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.vehicles.bulk_write(ops, ordered=False)
+
+    dropped = 0
+    if drop_fields and not dry_run and await db.vehicles.count_documents(_UNMIGRATED):
+        raise RuntimeError("Vehicles without documents were written during the backfill; "
+                           "make sure every worker runs with VEHICLE_LAYOUT=documents and retry")
+    if drop_fields:
+        query = {"documents": {"$exists": True}, "$or": [{f: {"$exists": True}} for f in EXPIRY_FIELDS]}
+        if dry_run:
+            dropped = await db.vehicles.count_documents(query)
+        else:
+            result = await db.vehicles.update_many(query, {"$unset": {f: "" for f in EXPIRY_FIELDS}})
+            dropped = result.modified_count
+
+    if not dry_run:
+        await ensure_indexes(db, 'documents' if drop_fields else 'dual')
+    return {"backfilled": backfilled, "dropped": dropped}
+
+
+def main(argv=None):
+    import argparse
+    import asyncio
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Migrate vehicles to the embedded documents layout")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--drop-fields", action="store_true",
+                        help="remove top-level expiry fields from migrated vehicles (set VEHICLE_LAYOUT=documents first)")
+    parser.add_argument("--dry-run", action="store_true", help="report counts without changing anything")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv(Path(__file__).parent / '.env')
+    if args.drop_fields and os.getenv('VEHICLE_LAYOUT', 'fields') != 'documents':
+        parser.error("--drop-fields requires VEHICLE_LAYOUT=documents on every worker")
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        result = asyncio.run(migrate(db, drop_fields=args.drop_fields, dry_run=args.dry_run))
+    finally:
+        client.close()
+    print(f"Backfilled {result['backfilled']}, dropped fields from {result['dropped']} vehicles"
+          + (" (dry run)" if args.dry_run else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -11,6 +11,8 @@ import { Search, Truck, AlertCircle } from 'lucide-react';
 import { toast } from 'sonner';
 import { format, differenceInDays } from 'date-fns';
 
+const LIST_FIELDS = 'registration_number,manufacturer,model,road_tax_expiry,insurance_expiry,puc_expiry';
+
 const container = {
   hidden: { opacity: 0 },
   show: {
@@ -51,7 +53,8 @@ export default function VehicleList() {
   const loadVehicles = async () => {
     try {
       const response = await axios.get(`${API}/vehicles`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { fields: LIST_FIELDS }
       });
       setVehicles(response.data);
       setFilteredVehicles(response.data);
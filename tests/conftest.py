@@ -0,0 +1,92 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+DB_NAME = "fleetcare_test"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeSession:
+    """mongomock has no sessions; handlers only pass them through."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def mongo_client():
+    from mongomock_motor import AsyncMongoMockClient
+
+    client = AsyncMongoMockClient()
+
+    async def start_session(**kwargs):
+        return FakeSession()
+
+    client.start_session = start_session
+    return client
+
+
+@pytest.fixture
+def db(mongo_client):
+    return mongo_client[DB_NAME]
+
+
+@pytest.fixture
+def config():
+    import server
+
+    return server.AppConfig(mongo_url="mongodb://localhost:27017", db_name=DB_NAME, enable_scheduler=False)
+
+
+@pytest.fixture
+async def app(config, mongo_client, monkeypatch):
+    """The API with its lifespan running against mongomock. Indexes are
+    ensured up front rather than in the background."""
+    import server
+
+    ensure_indexes = server.ensure_indexes
+
+    async def skip(runtime):
+        pass
+
+    monkeypatch.setattr(server, "AsyncIOMotorClient", lambda *args, **kwargs: mongo_client)
+    monkeypatch.setattr(server, "ensure_indexes", skip)
+    app = server.create_app(config)
+    async with app.router.lifespan_context(app):
+        await ensure_indexes(app.state.runtime)
+        yield app
+
+
+@pytest.fixture
+async def client(app):
+    import httpx
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def signup(client):
+    """Sign up a user and return the ``Authorization`` header for them."""
+    count = 0
+
+    async def signup(email=None):
+        nonlocal count
+        count += 1
+        response = await client.post("/api/auth/signup", json={
+            "email": email or f"user{count}@example.com", "password": "secret", "name": f"User {count}",
+        })
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return signup
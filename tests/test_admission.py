@@ -0,0 +1,233 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+import admission
+from admission import AdmissionController, EndpointPolicy, MemoryBucketStore, _ConcurrencyLimiter
+
+pytestmark = pytest.mark.anyio
+
+GENEROUS = dict(user_rate=100, user_burst=100, global_rate=100, global_burst=100, max_concurrency=10, max_queue=10)
+
+
+class FakeClock:
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+async def test_bucket_allows_burst_then_rejects_with_retry_after(clock):
+    store = MemoryBucketStore()
+    assert await store.take("k", rate=1, burst=2) == (True, 0.0)
+    assert await store.take("k", rate=1, burst=2) == (True, 0.0)
+    allowed, retry_after = await store.take("k", rate=1, burst=2)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+    clock.now += 0.5
+    allowed, retry_after = await store.take("k", rate=1, burst=2)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert (await store.take("k", rate=1, burst=2))[0]
+
+
+async def test_bucket_refill_is_capped_at_burst(clock):
+    store = MemoryBucketStore()
+    await store.take("k", rate=1, burst=2)
+    clock.now += 3600
+    results = [(await store.take("k", rate=1, burst=2))[0] for _ in range(3)]
+    assert results == [True, True, False]
+
+
+async def test_full_buckets_are_pruned(clock):
+    store = MemoryBucketStore(prune_interval=60)
+    await store.take("idle", rate=1, burst=5)
+    await store.take("busy", rate=0.01, burst=5)
+
+    clock.now += 61
+    await store.take("new", rate=1, burst=5)
+    assert set(store.buckets) == {"busy", "new"}
+
+
+async def test_concurrency_limiter_rejects_when_queue_full():
+    limiter = _ConcurrencyLimiter(limit=1, max_queue=1)
+    assert await limiter.acquire(timeout=1)
+
+    waiter = asyncio.create_task(limiter.acquire(timeout=1))
+    await asyncio.sleep(0)
+    assert limiter.waiting == 1
+    assert not await limiter.acquire(timeout=1)
+
+    limiter.release()
+    assert await waiter
+
+
+async def test_concurrency_limiter_rejects_after_queue_timeout():
+    limiter = _ConcurrencyLimiter(limit=1, max_queue=1)
+    assert await limiter.acquire(timeout=1)
+    assert not await limiter.acquire(timeout=0.01)
+    assert limiter.waiting == 0
+
+
+@pytest.mark.parametrize("overrides, status_code, reason, retry_after", [
+    (dict(user_rate=0.5, user_burst=1), 429, "user_rate", "2"),
+    (dict(global_rate=0.25, global_burst=1), 503, "global_rate", "4"),
+])
+async def test_rate_rejections(clock, overrides, status_code, reason, retry_after):
+    controller = AdmissionController({"create": EndpointPolicy(**{**GENEROUS, **overrides})})
+    async with controller.admit("create", "user:a"):
+        pass
+
+    with pytest.raises(HTTPException) as excinfo:
+        async with controller.admit("create", "user:a"):
+            pass
+    assert excinfo.value.status_code == status_code
+    assert excinfo.value.headers["Retry-After"] == retry_after
+    assert controller.shed == {f"create:{reason}": 1}
+
+
+async def test_concurrency_rejection_is_503_with_retry_after():
+    policy = EndpointPolicy(**{**GENEROUS, "max_concurrency": 1, "max_queue": 0, "queue_timeout": 3})
+    controller = AdmissionController({"bulk": policy})
+    async with controller.admit("bulk", "user:a"):
+        with pytest.raises(HTTPException) as excinfo:
+            async with controller.admit("bulk", "user:b"):
+                pass
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers["Retry-After"] == "3"
+    assert controller.stats()["in_flight"] == {"bulk": 0}
+
+
+async def test_rejected_requests_do_not_spend_tokens(clock):
+    policy = EndpointPolicy(**{**GENEROUS, "user_rate": 0.01, "user_burst": 2, "global_rate": 0.01, "global_burst": 1})
+    controller = AdmissionController({"create": policy})
+    async with controller.admit("create", "user:a"):
+        pass
+    for _ in range(3):
+        with pytest.raises(HTTPException) as excinfo:
+            async with controller.admit("create", "user:a"):
+                pass
+        assert excinfo.value.status_code == 503
+
+    tokens, _, _ = controller.store.buckets["create:user:a"]
+    assert tokens == pytest.approx(1)
+
+
+async def test_concurrency_rejection_gives_back_both_tokens():
+    policy = EndpointPolicy(**{**GENEROUS, "user_burst": 2, "global_burst": 2, "user_rate": 0.01,
+                               "global_rate": 0.01, "max_concurrency": 1, "max_queue": 0})
+    controller = AdmissionController({"bulk": policy})
+    async with controller.admit("bulk", "user:a"):
+        with pytest.raises(HTTPException):
+            async with controller.admit("bulk", "user:a"):
+                pass
+    buckets = controller.store.buckets
+    assert buckets["bulk:user:a"][0] == pytest.approx(1, abs=0.01)
+    assert buckets["bulk:*"][0] == pytest.approx(1, abs=0.01)
+
+
+async def test_anonymous_caller_without_key_uses_global_bucket_only():
+    controller = AdmissionController({"login": EndpointPolicy(**{**GENEROUS, "user_burst": 1})})
+    for _ in range(3):
+        async with controller.admit("login", None):
+            pass
+    assert set(controller.store.buckets) == {"login:*"}
+
+
+async def test_mongo_bucket_store(db, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "time", lambda: now[0])
+    store = admission.MongoBucketStore(lambda: db.rate_limits)
+
+    assert [(await store.take("k", rate=1, burst=2))[0] for _ in range(3)] == [True, True, False]
+    allowed, retry_after = await store.take("k", rate=1, burst=2)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+    await store.give_back("k", rate=1, burst=2)
+    assert (await store.take("k", rate=1, burst=2))[0]
+
+    now[0] += 1.5
+    assert (await store.take("k", rate=1, burst=2))[0]
+    assert not (await store.take("k", rate=1, burst=2))[0]
+    assert (await db.rate_limits.find_one({"_id": "k"}))["expires_at"] is not None
+    assert "expires_at_1" in await db.rate_limits.index_information()
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None),
+    ("", None),
+    ("none", []),
+    ("10.0.0.0/8, 192.168.1.1", ["10.0.0.0/8", "192.168.1.1"]),
+])
+def test_parse_trusted_proxies(value, expected):
+    assert admission.parse_trusted_proxies(value) == expected
+
+
+async def test_unknown_endpoint_class_is_not_limited():
+    controller = AdmissionController({})
+    async with controller.admit("anything", "user:a"):
+        pass
+
+
+@pytest.mark.parametrize("peer, forwarded_for, expected", [
+    ("10.0.0.5", "203.0.113.7", "203.0.113.7"),
+    ("10.0.0.5", "198.51.100.1, 203.0.113.7, 10.0.0.9", "203.0.113.7"),
+    ("10.0.0.5", "10.0.0.8, 10.0.0.9", "10.0.0.8"),
+    ("203.0.113.7", "198.51.100.1", "203.0.113.7"),
+    ("10.0.0.5", None, "10.0.0.5"),
+    (None, "198.51.100.1", "unknown"),
+])
+def test_client_address(peer, forwarded_for, expected):
+    trusted = admission.parse_networks(["10.0.0.0/8", " "])
+    assert admission.client_address(peer, forwarded_for, trusted) == expected
+
+
+@pytest.fixture
+def login_app():
+    import server
+
+    app = FastAPI()
+    app.state.admission = AdmissionController({"login": EndpointPolicy(**{**GENEROUS, "user_burst": 1})})
+    app.state.trusted_proxies = admission.parse_networks(["127.0.0.0/8"])
+
+    @app.post("/login", dependencies=[server.admit("login")])
+    async def login():
+        return {"ok": True}
+
+    return app
+
+
+async def test_rejection_response_carries_retry_after(login_app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=login_app, client=("127.0.0.1", 1234)),
+                                 base_url="http://test") as client:
+        headers = {"X-Forwarded-For": "203.0.113.7"}
+        assert (await client.post("/login", headers=headers)).status_code == 200
+        response = await client.post("/login", headers=headers)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+        # Another caller behind the same proxy has its own bucket.
+        response = await client.post("/login", headers={"X-Forwarded-For": "198.51.100.1"})
+        assert response.status_code == 200
+
+
+async def test_anonymous_callers_share_only_global_bucket_until_proxies_are_configured(login_app):
+    login_app.state.trusted_proxies = None
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=login_app, client=("127.0.0.1", 1234)),
+                                 base_url="http://test") as client:
+        for _ in range(3):
+            assert (await client.post("/login")).status_code == 200
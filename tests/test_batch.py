@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+import batch
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def headers(client, signup):
+    headers = await signup()
+    await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)
+    return headers
+
+
+async def run(client, headers, *requests):
+    response = await client.post("/api/batch", json={"requests": list(requests)}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["responses"]
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/vehicles", "/api/vehicles"),
+    ("/api/vehicles?fields=id", "/api/vehicles?fields=id"),
+    ("/api", "/api/"),
+    ("/apis", "/api/apis"),
+])
+def test_validate_path_accepts_both_forms(path, expected):
+    assert batch.validate_path(path) == expected
+
+
+@pytest.mark.parametrize("path", ["vehicles", "//evil.example/x", "/vehicles#x", "/batch", "/batch/", "/api/batch?x=1"])
+def test_validate_path_rejects(path):
+    with pytest.raises(batch.SubRequestError):
+        batch.validate_path(path)
+
+
+async def test_per_item_status_and_order(client, headers):
+    vehicles = (await client.get("/api/vehicles", headers=headers)).json()
+    responses = await run(client, headers,
+                          {"id": "list", "path": "/vehicles"},
+                          {"path": "/api/settings"},
+                          {"path": "/vehicles/missing"},
+                          {"path": "/api/batch"},
+                          {"path": "/vehicles?fields=bogus"})
+    assert [r["id"] for r in responses] == ["list", "1", "2", "3", "4"]
+    assert [r["status"] for r in responses] == [200, 200, 404, 400, 400]
+    assert responses[0]["body"] == vehicles
+    assert responses[1]["body"]["notification_days_before"] == 15
+    assert responses[3]["body"]["detail"] == "Batch requests cannot be nested"
+
+
+async def test_if_none_match_per_item(client, headers):
+    first = await run(client, headers, {"path": "/vehicles"}, {"path": "/dashboard/stats"})
+    again = await run(client, headers, {"path": "/vehicles", "if_none_match": first[0]["etag"]},
+                      {"path": "/api/dashboard/stats", "if_none_match": '"stale-0"'})
+    assert [r["status"] for r in again] == [304, 200]
+    assert again[0]["etag"] == first[0]["etag"]
+    assert "body" not in again[0]
+
+    direct = await client.get("/api/vehicles", headers={**headers, "If-None-Match": first[0]["etag"]})
+    assert direct.status_code == 304
+
+
+async def test_size_cap(client, headers, app):
+    limit = app.state.config.batch_max_size
+    response = await client.post("/api/batch", json={"requests": [{"path": "/settings"}] * (limit + 1)},
+                                 headers=headers)
+    assert response.status_code == 413
+    assert len(await run(client, headers, *[{"path": "/settings"}] * limit)) == limit
+
+
+async def test_requires_authentication(client):
+    response = await client.post("/api/batch", json={"requests": [{"path": "/vehicles"}]})
+    assert response.status_code in (401, 403)
+
+
+async def test_items_run_concurrently(client, headers, monkeypatch):
+    dispatch = batch.dispatch
+    in_flight = []
+    peak = []
+
+    async def slow_dispatch(*args, **kwargs):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.pop()
+        return await dispatch(*args, **kwargs)
+
+    monkeypatch.setattr(batch, "dispatch", slow_dispatch)
+    responses = await run(client, headers, *[{"path": "/vehicles"}] * 4)
+    assert [r["status"] for r in responses] == [200] * 4
+    assert max(peak) == 4
+
+
+async def test_version_and_settings_are_read_once_per_batch(client, headers, db, monkeypatch):
+    collection_class = type(db.settings)
+    find_one = collection_class.find_one
+    reads = []
+
+    async def counting_find_one(self, *args, **kwargs):
+        reads.append(self.name)
+        await asyncio.sleep(0.01)
+        return await find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "find_one", counting_find_one)
+    responses = await run(client, headers, {"path": "/vehicles"}, {"path": "/dashboard/stats"},
+                          {"path": "/settings"}, {"path": "/settings?v=2"})
+    assert [r["status"] for r in responses] == [200] * 4
+    assert reads.count("data_versions") == 1
+    assert reads.count("settings") == 1
@@ -0,0 +1,123 @@
+import gzip
+import json
+
+import brotli
+import httpx
+import pytest
+from fastapi import FastAPI, Request, Response
+
+from compression import CompressionMiddleware, negotiate_encoding, strip_encoding_suffix
+
+pytestmark = pytest.mark.anyio
+
+ITEMS = [{"id": i, "registration_number": f"MH12AB{i:04d}"} for i in range(100)]
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip;q=0.5", "gzip"),
+    ("gzip;q=bogus", None),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("etag, expected", [
+    ('"abc-3-gzip"', '"abc-3"'),
+    ('"abc-3-br"', '"abc-3"'),
+    ('"abc-3"', '"abc-3"'),
+])
+def test_strip_encoding_suffix(etag, expected):
+    assert strip_encoding_suffix(etag) == expected
+
+
+@pytest.fixture
+async def middleware_client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=512)
+
+    @app.get("/items")
+    async def items(request: Request, count: int = len(ITEMS)):
+        if request.headers.get("if-none-match"):
+            return Response(status_code=304, headers={"ETag": '"v-1"'})
+        return Response(json.dumps(ITEMS[:count]), media_type="application/json", headers={"ETag": '"v-1"'})
+
+    @app.get("/encoded")
+    async def encoded():
+        return Response(gzip.compress(b"x" * 1000), media_type="text/plain", headers={"Content-Encoding": "gzip"})
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.parametrize("encoding, decompress", [("gzip", gzip.decompress), ("br", brotli.decompress)])
+async def test_large_json_is_compressed(middleware_client, encoding, decompress):
+    async with middleware_client.stream("GET", "/items", headers={"Accept-Encoding": encoding}) as response:
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["etag"] == f'"v-1-{encoding}"'
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == len(raw)
+    assert json.loads(decompress(raw)) == ITEMS
+
+
+async def test_small_body_and_304_carry_the_negotiated_etag(middleware_client):
+    small = await middleware_client.get("/items", params={"count": 1}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert small.headers["etag"] == '"v-1-gzip"'
+    assert small.json() == ITEMS[:1]
+
+    cached = await middleware_client.get("/items", headers={"Accept-Encoding": "gzip", "If-None-Match": '"v-1-gzip"'})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == '"v-1-gzip"'
+
+
+async def test_identity_and_already_encoded_responses_pass_through(middleware_client):
+    response = await middleware_client.get("/items", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == '"v-1"'
+
+    response = await middleware_client.get("/encoded", headers={"Accept-Encoding": "br"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == b"x" * 1000
+
+
+@pytest.fixture
+async def headers(client, signup):
+    """A user with two vehicles."""
+    headers = await signup()
+    for number in ("MH12AB1234", "KA01CD5678"):
+        await client.post("/api/vehicles", json={"registration_number": number}, headers=headers)
+    return headers
+
+
+async def test_api_etag_round_trips_through_compression(client, headers):
+    first = await client.get("/api/vehicles", headers={**headers, "Accept-Encoding": "gzip"})
+    assert first.headers["etag"].endswith('-gzip"')
+    response = await client.get("/api/vehicles", headers={
+        **headers, "Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"],
+    })
+    assert response.status_code == 304
+    assert response.headers["etag"] == first.headers["etag"]
+
+
+async def test_fields_returns_only_requested_fields_in_model_form(client, headers):
+    full = (await client.get("/api/vehicles", headers=headers)).json()
+    sparse = await client.get("/api/vehicles", params={"fields": "registration_number,puc_expiry,created_at"},
+                              headers=headers)
+    assert sparse.status_code == 200
+    assert sparse.json() == [
+        {k: v[k] for k in ("id", "registration_number", "puc_expiry", "created_at")} for v in full
+    ]
+
+    vehicle_id = full[0]["id"]
+    one = await client.get(f"/api/vehicles/{vehicle_id}", params={"fields": "road_tax_expiry"}, headers=headers)
+    assert one.json() == {"id": vehicle_id, "road_tax_expiry": full[0]["road_tax_expiry"]}
+    assert full[0]["road_tax_expiry"].endswith("Z")
+
+    response = await client.get("/api/vehicles", params={"fields": "registration_number,password"}, headers=headers)
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
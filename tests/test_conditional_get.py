@@ -0,0 +1,99 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+# Identity encoding keeps the ETags as the handlers produce them.
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+@pytest.fixture
+async def headers(signup):
+    return {**await signup(), **IDENTITY}
+
+
+async def etag(client, headers, path="/api/vehicles", **params) -> str:
+    response = await client.get(path, params=params, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "private, no-cache"
+    return response.headers["etag"]
+
+
+async def revalidate(client, headers, if_none_match, path="/api/vehicles"):
+    return await client.get(path, headers={**headers, "If-None-Match": if_none_match})
+
+
+@pytest.mark.parametrize("path", ["/api/vehicles", "/api/dashboard/stats", "/api/settings",
+                                  "/api/notifications", "/api/notifications/archive"])
+async def test_matching_etag_returns_304(client, headers, path):
+    tag = await etag(client, headers, path)
+    response = await revalidate(client, headers, tag, path)
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == tag
+
+
+@pytest.mark.parametrize("if_none_match", [
+    "{tag}",
+    "W/{tag}",
+    '"other", {tag}',
+    "*",
+])
+async def test_if_none_match_forms(client, headers, if_none_match):
+    tag = await etag(client, headers)
+    response = await revalidate(client, headers, if_none_match.format(tag=tag))
+    assert response.status_code == 304
+
+
+async def test_mismatching_etag_returns_body(client, headers):
+    await etag(client, headers)
+    response = await revalidate(client, headers, '"stale-0"')
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+async def test_etag_depends_on_user_and_query(client, headers, signup):
+    tag = await etag(client, headers)
+    assert await etag(client, headers, fields="registration_number") != tag
+    other = {**await signup(), **IDENTITY}
+    assert (await revalidate(client, other, tag)).status_code == 200
+
+
+async def test_writes_bump_the_version(client, headers, db):
+    tags = [await etag(client, headers)]
+
+    vehicle = (await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)).json()
+    tags.append(await etag(client, headers))
+    await client.post("/api/vehicles/bulk", json={"registration_numbers": ["KA01CD5678"]}, headers=headers)
+    tags.append(await etag(client, headers))
+    await client.patch("/api/settings", json={"notification_days_before": 20}, headers=headers)
+    tags.append(await etag(client, headers))
+    await db.notifications.insert_one({"id": "n1", "user_id": vehicle["user_id"], "vehicle_id": vehicle["id"],
+                                       "title": "t", "message": "m", "notification_type": "puc", "is_read": False,
+                                       "created_at": "2025-01-01T00:00:00+00:00"})
+    assert (await client.patch("/api/notifications/n1/read", headers=headers)).status_code == 200
+    tags.append(await etag(client, headers))
+    await client.delete(f"/api/vehicles/{vehicle['id']}", headers=headers)
+    tags.append(await etag(client, headers))
+
+    assert len(set(tags)) == len(tags)
+    assert (await revalidate(client, headers, tags[0])).status_code == 200
+
+
+async def test_match_skips_the_main_query(client, headers, db, monkeypatch):
+    await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)
+    tag = await etag(client, headers)
+
+    collection_class = type(db.vehicles)
+    find = collection_class.find
+    queried = []
+
+    def counting_find(self, *args, **kwargs):
+        queried.append(self.name)
+        return find(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "find", counting_find)
+    assert (await revalidate(client, headers, tag)).status_code == 304
+    assert "vehicles" not in queried
+
+    assert (await revalidate(client, headers, '"stale-0"')).status_code == 200
+    assert "vehicles" in queried
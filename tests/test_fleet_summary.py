@@ -0,0 +1,159 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import fleet_summary
+import vehicle_documents
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2025, 1, 10, 9, 30, tzinfo=timezone.utc)
+MIDNIGHT = fleet_summary.summary_clock(START)
+
+# Expiries on and around every bucket boundary over the days rolled through
+# below, at both midnight and mid-morning, plus missing documents.
+OFFSETS = [-3, -1, 0, 1, 2, 5, 6, 29, 30, 31, 32, 35, 36, 60, 66, 67, None]
+
+
+def make_vehicle(user_id: str, index: int, layout: str) -> dict:
+    vehicle = {"id": f"{user_id}-{index}", "user_id": user_id, "registration_number": f"{user_id}-{index}"}
+    base = MIDNIGHT if index % 2 else START
+    for position, doc_type in enumerate(vehicle_documents.DOCUMENT_TYPES):
+        days = OFFSETS[(index + position * 5) % len(OFFSETS)]
+        if days is not None:
+            vehicle[f"{doc_type}_expiry"] = (base + timedelta(days=days)).isoformat()
+    return vehicle_documents.to_storage(vehicle, layout, START)
+
+
+async def seed(db, layout: str, users=("alice", "bob", "carol"), per_user: int = len(OFFSETS) * 2):
+    await db.vehicles.insert_many([
+        make_vehicle(user_id, index, layout) for user_id in users for index in range(per_user)
+    ])
+
+
+@pytest.mark.parametrize("layout", vehicle_documents.LAYOUTS)
+async def test_roll_forward_matches_rebuild(db, layout):
+    await seed(db, layout)
+    assert await fleet_summary.rebuild_all(db, now=START) == 3
+
+    adjusted = 0
+    for days in (1, 2, 5, 30, 31, 66):
+        now = START + timedelta(days=days)
+        adjusted += await fleet_summary.roll_forward(db, now=now, layout=layout)
+        assert await fleet_summary.verify_all(db, now=now) == {}
+    assert adjusted > 0
+
+
+async def test_roll_forward_moves_every_summary_to_the_new_clock(db):
+    await seed(db, "fields")
+    await fleet_summary.rebuild_all(db, user_id="alice", now=START)
+    await fleet_summary.rebuild_all(db, user_id="bob", now=START + timedelta(days=3))
+    await fleet_summary.rebuild_all(db, user_id="carol", now=START + timedelta(days=4))
+
+    now = START + timedelta(days=7)
+    await fleet_summary.roll_forward(db, now=now)
+
+    as_of = {s['_id']: s['as_of'] async for s in db.fleet_summaries.find({}, {"as_of": 1})}
+    assert set(as_of.values()) == {fleet_summary.summary_clock(now).isoformat()}
+    assert await fleet_summary.verify_all(db, now=now) == {}
+
+
+async def test_roll_forward_after_rolling_back_to_fields(db):
+    # Vehicles written in the documents layout keep only the array until
+    # they are next written, so the fields layout must still find them.
+    await db.vehicles.insert_many([make_vehicle("alice", index, "documents") for index in range(0, 34, 2)])
+    await db.vehicles.insert_many([make_vehicle("alice", index, "fields") for index in range(1, 34, 2)])
+    await fleet_summary.rebuild_all(db, now=START)
+
+    for days in (1, 6, 31):
+        now = START + timedelta(days=days)
+        await fleet_summary.roll_forward(db, now=now, layout="fields")
+        assert await fleet_summary.verify_all(db, now=now) == {}
+
+
+async def test_apply_delta_keeps_summary_current_across_roll_forward(db):
+    await seed(db, "dual", users=("alice",), per_user=4)
+    await fleet_summary.rebuild_all(db, now=START)
+
+    added = make_vehicle("alice", 5, "dual")
+    revision = await fleet_summary.summary_revision(db, "alice")
+    await db.vehicles.insert_one(dict(added))
+    await fleet_summary.apply_delta(db, "alice", fleet_summary.vehicle_delta(added, MIDNIGHT), revision, now=START)
+    assert await fleet_summary.verify_all(db, now=START) == {}
+
+    now = START + timedelta(days=30)
+    await fleet_summary.roll_forward(db, now=now)
+    assert await fleet_summary.verify_all(db, now=now) == {}
+
+
+async def add_vehicle(db, index: int):
+    """A vehicle write as the API does it."""
+    vehicle = make_vehicle("alice", index, "fields")
+    revision = await fleet_summary.summary_revision(db, "alice")
+    await db.vehicles.insert_one(dict(vehicle))
+    await fleet_summary.apply_delta(db, "alice", fleet_summary.vehicle_delta(vehicle, MIDNIGHT), revision, now=START)
+
+
+async def test_write_during_rebuild_is_not_lost(db, monkeypatch):
+    await seed(db, "fields", users=("alice",), per_user=4)
+    await fleet_summary.rebuild_all(db, now=START)
+    summarize = fleet_summary.summarize_vehicles
+    writes = []
+
+    def summarize_then_write(user_id, vehicles, clock):
+        # A write lands after the rebuild's snapshot but before its replace.
+        if not writes:
+            writes.append(asyncio.get_running_loop().create_task(add_vehicle(db, 5)))
+        return summarize(user_id, vehicles, clock)
+
+    replace_one = type(db.fleet_summaries).replace_one
+
+    async def replace_after_write(self, *args, **kwargs):
+        await asyncio.sleep(0.01)
+        return await replace_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(fleet_summary, "summarize_vehicles", summarize_then_write)
+    monkeypatch.setattr(type(db.fleet_summaries), "replace_one", replace_after_write)
+    summary = await fleet_summary.rebuild_user_summary(db, "alice", now=START)
+    await asyncio.gather(*writes)
+
+    assert summary["total_vehicles"] == 5
+    assert await fleet_summary.verify_all(db, now=START) == {}
+
+
+async def test_write_included_in_rebuild_is_not_counted_twice(db):
+    await seed(db, "fields", users=("alice",), per_user=4)
+    await fleet_summary.rebuild_all(db, now=START)
+
+    vehicle = make_vehicle("alice", 5, "fields")
+    revision = await fleet_summary.summary_revision(db, "alice")
+    await db.vehicles.insert_one(dict(vehicle))
+    # A rebuild lands between the vehicle write and its delta.
+    await fleet_summary.rebuild_user_summary(db, "alice", now=START)
+    await fleet_summary.apply_delta(db, "alice", fleet_summary.vehicle_delta(vehicle, MIDNIGHT), revision, now=START)
+
+    assert (await db.fleet_summaries.find_one({"_id": "alice"}))["total_vehicles"] == 5
+    assert await fleet_summary.verify_all(db, now=START) == {}
+
+
+async def test_legacy_summary_without_revision_accepts_deltas(db):
+    await seed(db, "fields", users=("alice",), per_user=4)
+    await fleet_summary.rebuild_all(db, now=START)
+    await db.fleet_summaries.update_one({"_id": "alice"}, {"$unset": {"revision": ""}})
+
+    await add_vehicle(db, 5)
+    summary = await db.fleet_summaries.find_one({"_id": "alice"})
+    assert summary["total_vehicles"] == 5
+    assert summary["revision"] == 1
+
+
+@pytest.mark.parametrize("days, bucket", [
+    (-1, "overdue"),
+    (0, "expiring"),
+    (30, "expiring"),
+    (31, "valid"),
+])
+def test_classify_expiry_boundaries(days, bucket):
+    assert fleet_summary.classify_expiry((MIDNIGHT + timedelta(days=days)).isoformat(), MIDNIGHT) == bucket
+    assert fleet_summary.classify_expiry(None, MIDNIGHT) == "missing"
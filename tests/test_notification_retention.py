@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import notification_retention
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2025, 6, 15, tzinfo=timezone.utc)
+
+
+def notification(user_id: str, index: int, days_ago: int, is_read: bool = False) -> dict:
+    return {"id": f"{user_id}-{index}", "user_id": user_id, "vehicle_id": "v1", "title": f"Reminder {index}",
+            "message": "Expiring soon", "notification_type": "puc",
+            "is_read": is_read, "created_at": (NOW - timedelta(days=days_ago)).isoformat()}
+
+
+async def test_archive_stale_moves_old_unread_notifications(db):
+    await db.notifications.insert_many([
+        notification("alice", 1, 100), notification("alice", 2, 130), notification("alice", 3, 10),
+        notification("alice", 4, 120, is_read=True), notification("bob", 1, 95),
+    ])
+    assert await notification_retention.archive_stale(db, now=NOW) == {"alice", "bob"}
+
+    remaining = {n["id"] async for n in db.notifications.find()}
+    assert remaining == {"alice-3", "alice-4"}
+    archive = {a["_id"]: a async for a in db.notification_archive.find()}
+    assert set(archive) == {"alice:2025-03", "alice:2025-02", "bob:2025-03"}
+    assert [i["id"] for i in archive["alice:2025-03"]["items"]] == ["alice-1"]
+    assert archive["alice:2025-02"]["count"] == 1
+    # Read notifications from before the TTL field get one.
+    assert (await db.notifications.find_one({"id": "alice-4"}))["read_at"] is not None
+
+    assert await notification_retention.archive_stale(db, now=NOW) == set()
+
+
+async def test_archive_stale_resumes_without_duplicates(db, monkeypatch):
+    await db.notifications.insert_many([notification("alice", i, 100 + i) for i in range(3)])
+    delete_many = type(db.notifications).delete_many
+
+    async def crash(self, *args, **kwargs):
+        raise RuntimeError("worker stopped")
+
+    monkeypatch.setattr(type(db.notifications), "delete_many", crash)
+    with pytest.raises(RuntimeError):
+        await notification_retention.archive_stale(db, now=NOW)
+
+    monkeypatch.setattr(type(db.notifications), "delete_many", delete_many)
+    await db.notifications.insert_one(notification("alice", 3, 100))
+    await notification_retention.archive_stale(db, now=NOW)
+
+    archive = await db.notification_archive.find_one({"_id": "alice:2025-03"})
+    assert sorted(i["id"] for i in archive["items"]) == ["alice-0", "alice-1", "alice-2", "alice-3"]
+    assert archive["count"] == 4
+    assert await db.notifications.count_documents({}) == 0
+
+
+async def test_get_archive_pages_by_month(db):
+    await db.notifications.insert_many([
+        notification("alice", i, days) for i, days in enumerate([95, 100, 130, 160, 190])
+    ] + [notification("bob", 1, 100)])
+    await notification_retention.archive_stale(db, now=NOW)
+
+    page = await notification_retention.get_archive(db, "alice", limit=2)
+    assert [m["month"] for m in page["months"]] == ["2025-03", "2025-02"]
+    assert [i["id"] for i in page["months"][0]["items"]] == ["alice-0", "alice-1"]
+    assert page["next_before"] == "2025-02"
+
+    page = await notification_retention.get_archive(db, "alice", before=page["next_before"], limit=2)
+    assert [m["month"] for m in page["months"]] == ["2025-01", "2024-12"]
+    page = await notification_retention.get_archive(db, "alice", before=page["next_before"], limit=2)
+    assert page == {"months": [], "next_before": None}
+
+
+async def test_unread_cutoff_query_is_indexed(db):
+    await notification_retention.ensure_indexes(db)
+    indexes = await db.notifications.index_information()
+    assert indexes["unread_created_at"]["partialFilterExpression"] == {"is_read": False}
+    assert "read_at_ttl" in indexes and "user_read_at" in indexes
+
+
+async def test_expired_read_notification_changes_list_etag(client, signup, db):
+    headers = await signup()
+    user_id = (await client.get("/api/auth/me", headers=headers)).json()["id"]
+    await db.notifications.insert_many([
+        {**notification(user_id, 1, 1), "is_read": True, "read_at": datetime.now(timezone.utc)},
+        notification(user_id, 2, 2),
+    ])
+    first = await client.get("/api/notifications", headers=headers)
+    assert len(first.json()) == 2
+    cached = {**headers, "If-None-Match": first.headers["etag"]}
+    assert (await client.get("/api/notifications", headers=cached)).status_code == 304
+
+    # What the TTL monitor does: delete without bumping the data version.
+    await db.notifications.delete_one({"id": f"{user_id}-1"})
+    response = await client.get("/api/notifications", headers=cached)
+    assert response.status_code == 200
+    assert [n["id"] for n in response.json()] == [f"{user_id}-2"]
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import profiler
+from profiler import MongoWaitListener, ProfileStore, RunProfile, _Sampler, profile_run
+
+pytestmark = pytest.mark.anyio
+
+TOKEN = "profiling-secret"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ProfileStore(tmp_path / "profiles", keep=3)
+
+
+@pytest.fixture
+def config(config, tmp_path):
+    return config.model_copy(update={"profiler_token": TOKEN, "profile_dir": str(tmp_path / "profiles")})
+
+
+def make_profile(name: str, stacks: dict) -> RunProfile:
+    profile = RunProfile(name)
+    profile.stacks.update(stacks)
+    return profile
+
+
+def test_store_saves_collapsed_stacks_and_metadata(store):
+    profile = make_profile("GET /api/vehicles", {"handler;[mongo wait]": 3, "handler;render": 5})
+    store.save(profile)
+
+    path = store.path(profile.id)
+    assert path.read_text() == "handler;render 5\nhandler;[mongo wait] 3\n"
+    assert store.list() == [json.loads(path.with_suffix(".json").read_text())]
+    assert store.list()[0]["name"] == "GET /api/vehicles"
+
+
+def test_store_keeps_the_newest_profiles(store, monkeypatch):
+    ids = []
+    for millis in range(1000, 1005):
+        monkeypatch.setattr(profiler.time, "time", lambda millis=millis: millis)
+        profile = make_profile(f"run {millis}", {"a": 1})
+        store.save(profile)
+        ids.append(profile.id)
+
+    assert [meta["id"] for meta in store.list()] == ids[:1:-1]
+    assert [meta["id"] for meta in store.list(limit=1)] == [ids[-1]]
+    assert store.path(ids[0]) is None
+    assert sorted(p.name for p in store.directory.iterdir()) == sorted(
+        f"{profile_id}{suffix}" for profile_id in ids[2:] for suffix in (".collapsed", ".json")
+    )
+
+
+@pytest.mark.parametrize("profile_id", ["../secrets", "123-ABCDEF12", "123-abcdef1", "123-abcdef12.json"])
+def test_store_rejects_malformed_ids(store, profile_id):
+    assert store.path(profile_id) is None
+
+
+def test_store_lists_nothing_before_the_first_save(store):
+    assert store.list() == []
+
+
+async def test_sampler_records_await_chain_and_mongo_wait():
+    profile = RunProfile("job")
+    gate = asyncio.Event()
+
+    async def waiting_job():
+        await gate.wait()
+
+    task = asyncio.create_task(waiting_job())
+    await asyncio.sleep(0)
+    sampler = _Sampler(profile, task, interval=1)
+    sampler.sample()
+    profile.mongo_inflight = 1
+    sampler.sample()
+    gate.set()
+    await task
+
+    assert (profile.cpu_samples, profile.wait_samples, profile.mongo_wait_samples) == (0, 1, 1)
+    leaves = {stack.rsplit(";", 1)[1] for stack in profile.stacks}
+    assert leaves == {"[await]", "[mongo wait]"}
+    assert all("waiting_job" in stack.split(";")[0] for stack in profile.stacks)
+
+
+async def test_profile_run_samples_running_code_and_saves(store):
+    def busy(seconds):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+
+    async with profile_run("job busy", store, interval=0.001) as profile:
+        busy(0.1)
+        await asyncio.sleep(0.05)
+
+    assert profile.cpu_samples > 0
+    assert profile.wait_samples > 0
+    assert any("busy" in stack for stack in profile.stacks)
+    assert profile.wall_time >= 0.15
+    assert store.list()[0]["id"] == profile.id
+
+
+async def test_mongo_wait_listener_charges_the_active_profile(store):
+    listener = MongoWaitListener()
+    listener.started(SimpleNamespace(command_name="find"))
+
+    async with profile_run("job mongo", store, interval=1) as profile:
+        listener.started(SimpleNamespace(command_name="find"))
+        assert profile.mongo_inflight == 1
+        listener.succeeded(SimpleNamespace(duration_micros=1500))
+        listener.started(SimpleNamespace(command_name="aggregate"))
+        listener.failed(SimpleNamespace(duration_micros=500))
+
+    assert profile.mongo_inflight == 0
+    assert profile.metadata()["mongo_ms"] == 2.0
+    assert profile.metadata()["mongo_commands"] == {"find": 1, "aggregate": 1}
+
+
+async def test_token_is_accepted_from_the_header_only(client, app):
+    response = await client.get("/api/health", params={"profile": TOKEN})
+    assert "x-profile-id" not in response.headers
+
+    response = await client.get("/api/health", headers={"X-Profile-Token": "wrong"})
+    assert "x-profile-id" not in response.headers
+
+    response = await client.get("/api/health", headers={"X-Profile-Token": TOKEN})
+    profile_id = response.headers["x-profile-id"]
+    assert app.state.profile_store.path(profile_id) is not None
+
+    download = await client.get(f"/api/profiles/{profile_id}", headers={"X-Profile-Token": TOKEN})
+    assert download.status_code == 200
+    assert (await client.get(f"/api/profiles/{profile_id}", params={"profile": TOKEN})).status_code == 403
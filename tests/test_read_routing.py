@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+
+import read_routing
+from read_routing import ReadNodeListener, ReadRouter, primary_reads
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("seconds", [-1, 90, 300])
+def test_max_staleness_accepts_disabled_or_at_least_90(config, seconds):
+    import server
+
+    assert server.AppConfig(**{**config.model_dump(), "max_staleness_seconds": seconds}).max_staleness_seconds == seconds
+
+
+@pytest.mark.parametrize("seconds", [0, 30, 89, -2])
+def test_max_staleness_rejects_smaller_values(config, seconds):
+    import server
+
+    with pytest.raises(ValidationError, match="at least 90"):
+        server.AppConfig(**{**config.model_dump(), "max_staleness_seconds": seconds})
+
+
+def test_read_preference_modes():
+    assert read_routing.read_preference("secondaryPreferred", 120).max_staleness == 120
+    assert read_routing.read_preference("primary").mongos_mode == "primary"
+    with pytest.raises(ValueError):
+        read_routing.read_preference("fastest")
+
+
+def read_event(command_name="find", host="db1"):
+    return SimpleNamespace(command_name=command_name, connection_id=(host, 27017))
+
+
+async def test_listener_counts_primary_reads_outside_the_read_class(mongo_client):
+    listener = ReadNodeListener()
+    router = ReadRouter(mongo_client, "fleetcare_test")
+
+    listener.succeeded(read_event())
+    async with router.session("lists"):
+        listener.succeeded(read_event(host="db2"))
+        listener.succeeded(read_event("insert", host="db2"))
+        with primary_reads():
+            listener.succeeded(read_event())
+        listener.succeeded(read_event("getMore", host="db2"))
+
+    assert listener.stats() == {"primary": {"db1:27017": 2}, "lists": {"db2:27017": 2}}
+
+
+async def test_version_read_counts_as_primary(client, signup, db, monkeypatch):
+    headers = await signup()
+    collection_class = type(db.vehicles)
+    classes = {}
+    originals = {name: getattr(collection_class, name) for name in ("find", "find_one")}
+
+    def recording(name):
+        def method(self, *args, **kwargs):
+            classes.setdefault(self.name, set()).add(read_routing._read_class.get())
+            return originals[name](self, *args, **kwargs)
+        return method
+
+    for name in originals:
+        monkeypatch.setattr(collection_class, name, recording(name))
+    assert (await client.get("/api/vehicles", headers=headers)).status_code == 200
+    assert classes["data_versions"] == {"primary"}
+    assert classes["vehicles"] == {"lists"}
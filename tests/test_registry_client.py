@@ -0,0 +1,254 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+import registry_stub
+import registry_client
+from registry_client import CircuitBreaker, HttpRegistryClient, RegistryError, RegistryUnavailable
+
+pytestmark = pytest.mark.anyio
+
+
+class ScriptedRandom:
+    """Stands in for ``random`` in the stub: ``uniform`` yields the scripted
+    latency offsets and ``random`` the scripted error draws, in order."""
+
+    def __init__(self, offsets=(), draws=()):
+        self.offsets = list(offsets)
+        self.draws = list(draws)
+
+    def uniform(self, low, high):
+        return self.offsets.pop(0) if self.offsets else 0.0
+
+    def random(self):
+        return self.draws.pop(0) if self.draws else 1.0
+
+
+@pytest.fixture(scope="module")
+def registry_url():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(registry_stub.app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "registry stub did not start"
+        time.sleep(0.01)
+    yield "http://%s:%d" % sock.getsockname()
+    server.should_exit = True
+    thread.join(5)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(registry_stub, "LATENCY_MS", 0)
+    monkeypatch.setattr(registry_stub, "JITTER_MS", 0)
+    monkeypatch.setattr(registry_stub, "ERROR_RATE", 0)
+    return monkeypatch
+
+
+@pytest.fixture
+async def make_client(registry_url):
+    clients = []
+
+    def make(**kwargs):
+        kwargs.setdefault("hedge_delay", 0.05)
+        client = HttpRegistryClient(registry_url, **kwargs)
+        attempts = client._attempt
+
+        async def counted(registration_number):
+            client.attempts += 1
+            return await attempts(registration_number)
+
+        client.attempts = 0
+        client._attempt = counted
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        await client.aclose()
+
+
+async def test_lookup_returns_registry_payload(stub, make_client):
+    client = make_client()
+    vehicle = await client.lookup("mh12ab1234")
+    assert vehicle["registration_number"] == "MH12AB1234"
+    assert client.attempts == 1
+    assert client.breaker.state == "closed"
+
+
+async def test_hedged_attempt_overtakes_slow_one(stub, make_client):
+    stub.setattr(registry_stub, "LATENCY_MS", 500)
+    stub.setattr(registry_stub, "JITTER_MS", 500)
+    stub.setattr(registry_stub, "random", ScriptedRandom(offsets=[500, -500]))
+    # Long enough for the fast attempt to answer on a loaded machine.
+    client = make_client(hedge_delay=0.2)
+
+    started = time.monotonic()
+    await client.lookup("MH12AB1234")
+    assert time.monotonic() - started < 0.5
+    assert client.attempts == 2
+
+
+async def test_retryable_error_is_retried_without_tripping_breaker(stub, make_client):
+    stub.setattr(registry_stub, "ERROR_RATE", 0.5)
+    stub.setattr(registry_stub, "random", ScriptedRandom(draws=[0.0, 0.9]))
+    client = make_client(hedge_delay=5)
+
+    await client.lookup("MH12AB1234")
+    assert client.attempts == 2
+    assert client.breaker.failures == 0
+
+
+async def test_breaker_opens_after_consecutive_failures(stub, make_client):
+    stub.setattr(registry_stub, "ERROR_RATE", 1)
+    client = make_client(max_attempts=2, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30))
+
+    for _ in range(2):
+        with pytest.raises(RegistryUnavailable):
+            await client.lookup("MH12AB1234")
+    assert client.breaker.state == "open"
+    assert client.attempts == 4
+
+    with pytest.raises(RegistryUnavailable) as excinfo:
+        await client.lookup("MH12AB1234")
+    assert excinfo.value.retry_after > 0
+    assert client.attempts == 4
+
+
+async def test_half_open_probe_closes_breaker(stub, make_client):
+    stub.setattr(registry_stub, "ERROR_RATE", 1)
+    client = make_client(max_attempts=1, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1))
+    with pytest.raises(RegistryUnavailable):
+        await client.lookup("MH12AB1234")
+    assert client.breaker.state == "open"
+
+    await asyncio.sleep(0.15)
+    assert client.breaker.state == "half-open"
+    stub.setattr(registry_stub, "ERROR_RATE", 0)
+    await client.lookup("MH12AB1234")
+    assert client.breaker.state == "closed"
+
+
+async def test_half_open_admits_a_single_probe(stub, make_client):
+    stub.setattr(registry_stub, "ERROR_RATE", 1)
+    client = make_client(max_attempts=1, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1))
+    with pytest.raises(RegistryUnavailable):
+        await client.lookup("MH12AB1234")
+    await asyncio.sleep(0.15)
+
+    stub.setattr(registry_stub, "ERROR_RATE", 0)
+    stub.setattr(registry_stub, "LATENCY_MS", 200)
+    probe = asyncio.create_task(client.lookup("MH12AB1234"))
+    await asyncio.sleep(0.05)
+    with pytest.raises(RegistryUnavailable):
+        await client.lookup("MH12AB1234")
+    await probe
+    assert client.breaker.state == "closed"
+
+
+async def test_cancelled_probe_releases_half_open_slot(stub, make_client):
+    stub.setattr(registry_stub, "ERROR_RATE", 1)
+    client = make_client(max_attempts=1, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1))
+    with pytest.raises(RegistryUnavailable):
+        await client.lookup("MH12AB1234")
+    await asyncio.sleep(0.15)
+
+    stub.setattr(registry_stub, "ERROR_RATE", 0)
+    stub.setattr(registry_stub, "LATENCY_MS", 1000)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(client.lookup("MH12AB1234"), 0.05)
+    assert client.breaker.state == "half-open"
+
+    stub.setattr(registry_stub, "LATENCY_MS", 0)
+    await client.lookup("MH12AB1234")
+    assert client.breaker.state == "closed"
+
+
+class FixedPayload:
+    """Stands in for the stub's mock registry, answering every lookup with
+    ``payload``."""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def lookup(self, registration_number):
+        return self.payload
+
+
+def valid_payload(**overrides):
+    payload = {"registration_number": "MH12AB1234", "vehicle_type": "Commercial Vehicle",
+               "manufacturer": "TATA", "model": "LPT 1918", "year": 2020, "owner_name": "Fleet Owner",
+               **{field: "2030-01-01T00:00:00+00:00" for field in registry_client.EXPIRY_FIELDS}}
+    payload.update(overrides)
+    return {k: v for k, v in payload.items() if v is not None}
+
+
+@pytest.mark.parametrize("payload", [
+    [],
+    valid_payload(owner_name=None),
+    valid_payload(year="2020"),
+    valid_payload(year=True),
+    valid_payload(puc_expiry=None),
+    valid_payload(insurance_expiry="next week"),
+    valid_payload(fitness_expiry=20300101),
+])
+async def test_malformed_payload_raises_registry_error(stub, make_client, payload):
+    stub.setattr(registry_stub, "mock", FixedPayload(payload))
+    client = make_client(hedge_delay=5)
+    with pytest.raises(RegistryError) as excinfo:
+        await client.lookup("MH12AB1234")
+    assert not isinstance(excinfo.value, RegistryUnavailable)
+    assert client.attempts == 1
+    assert client.breaker.failures == 1
+
+
+async def test_valid_payload_passes_through(stub, make_client):
+    stub.setattr(registry_stub, "mock", FixedPayload(valid_payload()))
+    assert await make_client().lookup("MH12AB1234") == valid_payload()
+
+
+def test_create_registry_client_from_config(config):
+    assert isinstance(registry_client.create_registry_client(config), registry_client.MockRegistryClient)
+
+    http_config = config.model_copy(update={"registry_provider": "http", "registry_url": "http://registry.test",
+                                            "registry_max_attempts": 5, "registry_breaker_threshold": 2})
+    client = registry_client.create_registry_client(http_config)
+    assert isinstance(client, HttpRegistryClient)
+    assert str(client.client.base_url) == "http://registry.test"
+    assert client.max_attempts == 5
+    assert client.breaker.failure_threshold == 2
+
+    with pytest.raises(ValueError, match="REGISTRY_URL"):
+        registry_client.create_registry_client(config.model_copy(update={"registry_provider": "http"}))
+
+
+def test_registry_settings_come_from_env(monkeypatch):
+    import server
+
+    monkeypatch.setenv("MONGO_URL", "mongodb://localhost:27017")
+    monkeypatch.setenv("DB_NAME", "fleetcare_test")
+    monkeypatch.setenv("REGISTRY_PROVIDER", "http")
+    monkeypatch.setenv("REGISTRY_URL", "http://registry.test")
+    monkeypatch.setenv("REGISTRY_HEDGE_DELAY", "0.5")
+    config = server.AppConfig.from_env()
+    assert (config.registry_provider, config.registry_url, config.registry_hedge_delay) == \
+        ("http", "http://registry.test", 0.5)
+
+
+async def test_malformed_payload_is_a_bad_gateway(app, client, signup):
+    class MalformedRegistry(registry_client.VehicleRegistryClient):
+        async def lookup(self, registration_number):
+            raise RegistryError("registry payload has no valid owner_name")
+
+    app.state.runtime.registry_client = MalformedRegistry()
+    response = await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"},
+                                 headers=await signup())
+    assert response.status_code == 502
+    assert response.json()["detail"] == "Vehicle registry returned an invalid response"
@@ -0,0 +1,107 @@
+import pytest
+
+import settings_store
+from settings_store import SettingsStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def store(db):
+    import server
+
+    return SettingsStore(db.settings, server.UserSettings, ttl=60)
+
+
+@pytest.fixture
+def queries(db, monkeypatch):
+    """Collection names of every settings query issued."""
+    collection_class = type(db.settings)
+    issued = []
+    for method in ("find", "find_one"):
+        original = getattr(collection_class, method)
+
+        def counting(self, *args, _original=original, **kwargs):
+            issued.append(self.name)
+            return _original(self, *args, **kwargs)
+
+        monkeypatch.setattr(collection_class, method, counting)
+    return issued
+
+
+async def test_defaults_for_users_without_settings(store, db):
+    settings = await store.get("alice")
+    assert settings.notification_days_before == 15
+    assert settings.updated_at is None
+    assert await db.settings.count_documents({}) == 0
+
+
+async def test_version_tagged_entries_are_reloaded_when_the_version_moves(store, db, queries):
+    await db.settings.insert_one({"user_id": "alice", "notification_days_before": 10})
+    assert (await store.get("alice", version=1)).notification_days_before == 10
+
+    # A write on another worker: the document and the version change.
+    await db.settings.update_one({"user_id": "alice"}, {"$set": {"notification_days_before": 20}})
+    assert (await store.get("alice", version=1)).notification_days_before == 10
+    assert (await store.get("alice", version=2)).notification_days_before == 20
+    assert queries == ["settings", "settings"]
+
+
+async def test_untagged_entries_expire_after_ttl(store, db, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(settings_store.time, "monotonic", lambda: now[0])
+    await store.get("alice")
+    await db.settings.insert_one({"user_id": "alice", "notification_days_before": 10})
+    assert (await store.get("alice")).notification_days_before == 15
+
+    now[0] += 61
+    assert (await store.get("alice")).notification_days_before == 10
+
+
+async def test_update_upserts_with_defaults_and_invalidates(store, db):
+    await store.get("alice", version=1)
+    await store.update("alice", {"notification_days_before": 7, "updated_at": "2025-01-01T00:00:00+00:00"})
+
+    stored = await db.settings.find_one({"user_id": "alice"}, {"_id": 0})
+    assert stored["notification_days_before"] == 7
+    assert stored["email_notifications"] is True
+    settings = await store.get("alice", version=1)
+    assert settings.notification_days_before == 7
+    assert settings.updated_at.year == 2025
+
+
+async def test_get_many_reads_only_uncached_users_in_one_query(store, db, queries):
+    await db.settings.insert_many([
+        {"user_id": "alice", "notification_days_before": 10},
+        {"user_id": "bob", "notification_days_before": 20},
+    ])
+    await store.get("alice")
+    queries.clear()
+
+    result = await store.get_many(["alice", "bob", "carol", "bob"])
+    assert {user_id: s.notification_days_before for user_id, s in result.items()} == {
+        "alice": 10, "bob": 20, "carol": 15,
+    }
+    assert queries == ["settings"]
+
+    await store.get_many(["bob", "carol"])
+    assert queries == ["settings"]
+
+
+async def test_cache_is_bounded(db):
+    import server
+
+    store = SettingsStore(db.settings, server.UserSettings, max_entries=2)
+    await store.get_many(["a", "b"])
+    await store.get("c")
+    assert set(store._cache) == {"c"}
+
+
+async def test_settings_endpoint_has_no_updated_at_until_saved(client, signup):
+    headers = await signup()
+    assert (await client.get("/api/settings", headers=headers)).json()["updated_at"] is None
+
+    await client.patch("/api/settings", json={"notification_days_before": 20}, headers=headers)
+    settings = (await client.get("/api/settings", headers=headers)).json()
+    assert settings["notification_days_before"] == 20
+    assert settings["updated_at"] is not None
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import vehicle_documents
+from vehicle_documents import EXPIRY_FIELDS
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2025, 1, 10, tzinfo=timezone.utc)
+
+
+def iso(days: int) -> str:
+    return (NOW + timedelta(days=days)).isoformat()
+
+
+FIELDS = {"id": "v1", "user_id": "alice", "road_tax_expiry": iso(-5), "insurance_expiry": iso(20),
+          "puc_expiry": iso(40), "fitness_expiry": None}
+
+
+def test_to_storage_per_layout():
+    assert vehicle_documents.to_storage(FIELDS, "fields", NOW) == FIELDS
+
+    dual = vehicle_documents.to_storage(FIELDS, "dual", NOW)
+    assert {k: dual[k] for k in FIELDS} == FIELDS
+    assert dual["documents"] == [
+        {"type": "road_tax", "expiry": iso(-5), "status": "expired"},
+        {"type": "insurance", "expiry": iso(20), "status": "active"},
+        {"type": "puc", "expiry": iso(40), "status": "active"},
+    ]
+
+    documents = vehicle_documents.to_storage(FIELDS, "documents", NOW)
+    assert not set(EXPIRY_FIELDS) & set(documents)
+    assert documents["documents"] == dual["documents"]
+    assert documents["user_id"] == "alice"
+
+
+@pytest.mark.parametrize("layout, unset", [
+    ("fields", {"documents"}),
+    ("dual", None),
+    ("documents", set(EXPIRY_FIELDS)),
+])
+def test_storage_update_removes_the_other_layout(layout, unset):
+    update = vehicle_documents.storage_update(FIELDS, layout, NOW)
+    assert update["$set"] == vehicle_documents.to_storage(FIELDS, layout, NOW)
+    assert (set(update["$unset"]) if "$unset" in update else None) == unset
+
+
+def test_flatten_prefers_array_entries_and_honours_fields():
+    vehicle = {"id": "v1", "puc_expiry": iso(1), "insurance_expiry": iso(2),
+               "documents": [{"type": "puc", "expiry": iso(3), "status": "active"}]}
+    assert vehicle_documents.flatten(dict(vehicle)) == {
+        "id": "v1", "puc_expiry": iso(3), "insurance_expiry": iso(2),
+        "road_tax_expiry": None, "fitness_expiry": None,
+    }
+    assert vehicle_documents.flatten(dict(vehicle), ["id", "puc_expiry"]) == {
+        "id": "v1", "puc_expiry": iso(3), "insurance_expiry": iso(2),
+    }
+    assert vehicle_documents.flatten({"id": "v2", "puc_expiry": iso(1)}) == {"id": "v2", "puc_expiry": iso(1)}
+
+
+async def seed_layouts(db):
+    # The same expiries in every layout, plus an array-only vehicle whose
+    # stale top-level field must not match.
+    for layout in vehicle_documents.LAYOUTS:
+        await db.vehicles.insert_one(vehicle_documents.to_storage({**FIELDS, "id": layout}, layout, NOW))
+    await db.vehicles.insert_one({"id": "stale", "puc_expiry": iso(10), **vehicle_documents.to_storage(
+        {"puc_expiry": iso(100)}, "documents", NOW)})
+
+
+@pytest.mark.parametrize("layout, doc_types, bounds, expected", [
+    ("dual", ["insurance"], dict(gt=NOW, lte=iso(30)), {"fields", "dual", "documents"}),
+    ("dual", "puc", dict(gte=iso(30)), {"fields", "dual", "documents", "stale"}),
+    ("dual", ["road_tax", "fitness"], dict(gt=NOW), set()),
+    ("documents", ["insurance", "puc"], dict(lt=iso(30)), {"dual", "documents"}),
+    ("fields", ["puc"], dict(lte=iso(40)), {"fields", "dual", "stale"}),
+])
+async def test_expiry_filter(db, layout, doc_types, bounds, expected):
+    await seed_layouts(db)
+    query = vehicle_documents.expiry_filter(doc_types, layout, **bounds)
+    assert {v["id"] for v in await db.vehicles.find(query).to_list(None)} == expected
+
+
+async def test_expiring_pipeline_counts_either_layout(db):
+    await seed_layouts(db)
+    pipeline = vehicle_documents.expiring_pipeline(
+        match={"id": {"$ne": "stale"}}, group_by=("type", "bucket"),
+        buckets=[("overdue", "$lt", NOW), ("soon", "$lte", NOW + timedelta(days=30))], otherwise="later",
+    )
+    counts = {(r["_id"]["type"], r["_id"]["bucket"]): r["count"] async for r in db.vehicles.aggregate(pipeline)}
+    assert counts == {("road_tax", "overdue"): 3, ("insurance", "soon"): 3, ("puc", "later"): 3,
+                      ("fitness", "missing"): 3}
+
+    window = vehicle_documents.expiring_pipeline(doc_types=["puc"], group_by=("type",), gte=iso(30))
+    assert [r async for r in db.vehicles.aggregate(window)] == [{"_id": {"type": "puc"}, "count": 4}]
+
+
+async def test_migrate_backfills_then_drops_fields(db):
+    await db.vehicles.insert_many([
+        vehicle_documents.to_storage({**FIELDS, "id": "old"}, "fields", NOW),
+        vehicle_documents.to_storage({**FIELDS, "id": "new"}, "dual", NOW),
+    ])
+    assert await vehicle_documents.migrate(db, dry_run=True) == {"backfilled": 1, "dropped": 0}
+    assert await db.vehicles.count_documents({"documents": {"$exists": True}}) == 1
+
+    assert await vehicle_documents.migrate(db) == {"backfilled": 1, "dropped": 0}
+    old = await db.vehicles.find_one({"id": "old"})
+    assert vehicle_documents.expiries(old) == vehicle_documents.expiries(FIELDS)
+    assert vehicle_documents.INDEX_NAME in await db.vehicles.index_information()
+    assert "puc_expiry_1" in await db.vehicles.index_information()
+
+    assert await vehicle_documents.migrate(db, drop_fields=True) == {"backfilled": 0, "dropped": 2}
+    for vehicle in await db.vehicles.find().to_list(None):
+        assert not set(EXPIRY_FIELDS) & set(vehicle)
+        assert vehicle_documents.expiries(vehicle) == vehicle_documents.expiries(FIELDS)
+
+
+async def test_migrate_refuses_to_drop_fields_while_unmigrated_writes_land(db, monkeypatch):
+    await db.vehicles.insert_one(vehicle_documents.to_storage({**FIELDS, "id": "old"}, "fields", NOW))
+    bulk_write = type(db.vehicles).bulk_write
+
+    async def write_during_backfill(self, *args, **kwargs):
+        result = await bulk_write(self, *args, **kwargs)
+        await self.insert_one(vehicle_documents.to_storage({**FIELDS, "id": "late"}, "fields", NOW))
+        return result
+
+    monkeypatch.setattr(type(db.vehicles), "bulk_write", write_during_backfill)
+    with pytest.raises(RuntimeError):
+        await vehicle_documents.migrate(db, drop_fields=True)
+    assert await db.vehicles.count_documents({"puc_expiry": {"$exists": True}}) == 2
@@ -0,0 +1,160 @@
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import registration
+
+pytestmark = pytest.mark.anyio
+
+
+async def user_id(client, headers) -> str:
+    return (await client.get("/api/auth/me", headers=headers)).json()["id"]
+
+
+async def stored(db, uid):
+    return await db.vehicles.find({"user_id": uid}, {"_id": 0}).to_list(None)
+
+
+def race(monkeypatch, db, method, competitor):
+    """Make the next ``method`` call on ``vehicles`` lose a race: the
+    ``competitor`` vehicle is inserted first, as a concurrent request would."""
+    collection_class = type(db.vehicles)
+    original = getattr(collection_class, method)
+    state = {"raced": False}
+
+    async def racing(self, requests, *args, **kwargs):
+        if self.name != "vehicles" or state["raced"]:
+            return await original(self, requests, *args, **kwargs)
+        state["raced"] = True
+        await db.vehicles.insert_one(dict(competitor))
+        if method == "update_one":
+            raise DuplicateKeyError("E11000 duplicate key error")
+        # The competitor's upsert fails, the others go through.
+        lost = [i for i, op in enumerate(requests)
+                if op._filter["normalized_registration"] == competitor["normalized_registration"]]
+        won = [(i, op) for i, op in enumerate(requests) if i not in lost]
+        result = await original(self, [op for _, op in won], *args, **kwargs)
+        raise BulkWriteError({
+            "writeErrors": [{"index": i, "code": 11000, "errmsg": "E11000 duplicate key error"} for i in lost],
+            "upserted": [{"index": won[i][0], "_id": _id} for i, _id in result.upserted_ids.items()],
+        })
+
+    monkeypatch.setattr(collection_class, method, racing)
+
+
+def legacy_vehicle(uid: str, registration_number: str) -> dict:
+    return {"id": f"legacy-{registration_number}", "user_id": uid, "registration_number": registration_number,
+            "vehicle_type": "Truck", "owner_name": "", "manufacturer": "", "model": "", "year": 2019,
+            "created_at": "2024-01-01T00:00:00+00:00", "updated_at": "2024-01-01T00:00:00+00:00"}
+
+
+async def test_add_vehicle_is_idempotent_per_normalized_registration(client, signup, db):
+    headers = await signup()
+    first = await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)
+    again = await client.post("/api/vehicles", json={"registration_number": "mh-12 ab 1234"}, headers=headers)
+    assert first.status_code == again.status_code == 200
+    assert again.json()["id"] == first.json()["id"]
+    assert len(await stored(db, await user_id(client, headers))) == 1
+
+
+async def test_same_registration_for_different_users(client, signup, db):
+    for headers in (await signup(), await signup()):
+        response = await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)
+        assert response.status_code == 200
+    assert await db.vehicles.count_documents({}) == 2
+
+
+async def test_add_vehicle_on_conflict_error(client, signup):
+    headers = await signup()
+    await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)
+    response = await client.post("/api/vehicles", json={"registration_number": "MH12 AB1234", "on_conflict": "error"},
+                                 headers=headers)
+    assert response.status_code == 409
+    assert "MH12AB1234" in response.json()["detail"]
+
+
+async def test_add_vehicle_on_conflict_refresh(client, signup, db):
+    headers = await signup()
+    created = (await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)).json()
+    refreshed = await client.post("/api/vehicles", json={"registration_number": "MH12AB1234", "on_conflict": "refresh"},
+                                  headers=headers)
+    assert refreshed.status_code == 200
+    assert refreshed.json()["id"] == created["id"]
+    assert refreshed.json()["updated_at"] > created["updated_at"]
+    assert len(await stored(db, created["user_id"])) == 1
+
+
+async def test_legacy_vehicle_without_normalized_registration_is_matched(client, signup, db):
+    headers = await signup()
+    uid = await user_id(client, headers)
+    await db.vehicles.insert_one(legacy_vehicle(uid, "MH 12 AB 1234"))
+    assert await registration.ensure_registration_index(db)
+
+    response = await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)
+    assert response.json()["id"] == "legacy-MH 12 AB 1234"
+    assert len(await stored(db, uid)) == 1
+
+
+async def test_registration_index_reports_legacy_duplicates(db, caplog):
+    await db.vehicles.insert_many([legacy_vehicle("u1", "MH12AB1234"), legacy_vehicle("u1", "mh 12 ab 1234")])
+    assert not await registration.ensure_registration_index(db)
+    assert "dedupe" in caplog.text
+
+
+async def test_lost_insert_race_returns_the_winner(client, signup, db, monkeypatch):
+    headers = await signup()
+    uid = await user_id(client, headers)
+    winner = {**legacy_vehicle(uid, "MH12AB1234"), "id": "winner", "normalized_registration": "MH12AB1234"}
+    race(monkeypatch, db, "update_one", winner)
+
+    response = await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == "winner"
+    assert len(await stored(db, uid)) == 1
+
+
+async def test_bulk_collapses_duplicates_within_the_payload(client, signup, db):
+    headers = await signup()
+    response = await client.post("/api/vehicles/bulk", json={
+        "registration_numbers": ["MH12AB1234", "mh 12 ab 1234", "KA01CD5678", "???"],
+    }, headers=headers)
+    assert response.status_code == 200
+    assert [v["registration_number"] for v in response.json()] == ["MH12AB1234", "KA01CD5678"]
+    assert len(await stored(db, await user_id(client, headers))) == 2
+
+
+async def test_bulk_on_conflict_modes(client, signup, db):
+    headers = await signup()
+    existing = (await client.post("/api/vehicles", json={"registration_number": "MH12AB1234"}, headers=headers)).json()
+    payload = {"registration_numbers": ["MH12AB1234", "KA01CD5678"]}
+
+    response = await client.post("/api/vehicles/bulk", json={**payload, "on_conflict": "error"}, headers=headers)
+    assert response.status_code == 409
+    assert len(await stored(db, existing["user_id"])) == 1
+
+    response = await client.post("/api/vehicles/bulk", json=payload, headers=headers)
+    assert [v["id"] for v in response.json()][0] == existing["id"]
+    assert response.json()[0]["updated_at"] == existing["updated_at"]
+
+    response = await client.post("/api/vehicles/bulk", json={**payload, "on_conflict": "refresh"}, headers=headers)
+    assert [v["id"] for v in response.json()][0] == existing["id"]
+    assert response.json()[0]["updated_at"] > existing["updated_at"]
+    assert len(await stored(db, existing["user_id"])) == 2
+
+
+async def test_bulk_lost_race_returns_the_winner(client, signup, db, monkeypatch):
+    headers = await signup()
+    uid = await user_id(client, headers)
+    winner = {**legacy_vehicle(uid, "MH12AB1234"), "id": "winner", "normalized_registration": "MH12AB1234"}
+    race(monkeypatch, db, "bulk_write", winner)
+
+    response = await client.post("/api/vehicles/bulk", json={
+        "registration_numbers": ["KA01CD5678", "MH12AB1234", "DL3CAF0001"],
+    }, headers=headers)
+    assert response.status_code == 200
+    vehicles = response.json()
+    assert [v["registration_number"] for v in vehicles] == ["KA01CD5678", "MH12AB1234", "DL3CAF0001"]
+    assert vehicles[1]["id"] == "winner"
+    assert len(await stored(db, uid)) == 3
+
+    summary = await db.fleet_summaries.find_one({"_id": uid})
+    assert summary["total_vehicles"] == 3